@@ -1,6 +1,13 @@
+import pytest
 import vault_dev
 
 
 # https://stackoverflow.com/a/35394239
 def pytest_sessionstart(session):
     vault_dev.ensure_installed()
+
+
+# Keep the tests from reading or writing the user's cache
+@pytest.fixture(autouse=True)
+def orderly_web_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path / "cache"))
@@ -1,18 +1,48 @@
-import os
+import importlib
+import sys
+import types
 
-from orderly_web.pull import pull
-from orderly_web.start import start
-from orderly_web.status import status
-from orderly_web.stop import stop
-from orderly_web.admin import add_users, add_groups, add_members, grant
+# The commands are imported only when first used, as between them
+# they pull in docker, vault, PIL, etc, which makes the cli slow to
+# start up even for things like '--help'.
+_exports = {
+    "pull": "orderly_web.pull",
+    "start": "orderly_web.start",
+    "status": "orderly_web.status",
+    "health": "orderly_web.health",
+    "stop": "orderly_web.stop",
+    "upgrade": "orderly_web.upgrade",
+    "scale": "orderly_web.scale",
+    "add_users": "orderly_web.admin",
+    "add_groups": "orderly_web.admin",
+    "add_members": "orderly_web.admin",
+    "grant": "orderly_web.admin",
+    "apply_file": "orderly_web.admin",
+    "apply_operations": "orderly_web.admin",
+    "AdminSession": "orderly_web.admin",
+    "sync_permissions": "orderly_web.sync"
+}
 
-__all__ = [
-    pull,
-    start,
-    status,
-    stop,
-    add_users,
-    add_groups,
-    add_members,
-    grant
-]
+__all__ = list(_exports.keys())
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name not in _exports:
+            raise AttributeError(
+                "module '{}' has no attribute '{}'".format(__name__, name))
+        value = getattr(importlib.import_module(_exports[name]), name)
+        types.ModuleType.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        # Importing a submodule sets it as an attribute of this
+        # package, which would hide the function of the same name
+        # (e.g., orderly_web.start would become the module, not the
+        # function), so we ignore that.
+        if name in _exports and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyModule
@@ -1,7 +1,10 @@
+import os
+
 import docker
+import constellation.docker_util as docker_util
 
 from orderly_web.config import fetch_config
-from orderly_web.docker_helpers import docker_client, return_logs_and_remove
+from orderly_web.docker_helpers import docker_client
 
 
 def add_users(path, emails):
@@ -25,10 +28,157 @@ def grant(path, name, permissions):
 
 
 def run(path, args):
-    cfg = fetch_config(path)
-    image = str(cfg.images["admin"])
-    with docker_client() as cl:
-        mounts = [docker.types.Mount("/orderly", cfg.volumes["orderly"])]
-        result = return_logs_and_remove(cl, image, args, mounts)
+    with AdminSession(path) as session:
+        return session.run(args)
+
+
+def apply_file(path, filename):
+    """Apply the admin operations listed in a yml (or json) file,
+erroring if any of them fail"""
+    import yaml
+    with open(filename) as f:
+        operations = yaml.safe_load(f)
+    return check_results(apply_operations(path, operations or []))
+
+
+def check_results(results):
+    failed = [x for x in results if x["status"] != 0]
+    if failed:
+        raise Exception("{} of {} admin operations failed".format(
+            len(failed), len(results)))
+    return results
+
+
+def apply_operations(path, operations):
+    """Apply a list of admin operations, all within a single admin
+container.  Each operation is a dictionary with a single entry, e.g.,
+
+    {"add-users": ["a@example.com", "b@example.com"]}
+    {"add-groups": ["funders"]}
+    {"add-members": {"group": "funders", "emails": ["a@example.com"]}}
+    {"grant": {"group": "funders", "permissions": ["*/reports.read"]}}
+
+Returns a list with, for each operation, a dictionary of the command
+line arguments, the output and the exit status."""
+    cmds = [operation_args(x) for x in operations]
+    if not cmds:
+        return []
+    with AdminSession(path) as session:
+        results = [session.exec(args) for args in cmds]
+    report(results)
+    return results
+
+
+class AdminSession:
+    """Run admin commands in a single long-lived admin container,
+rather than a new container for each command.  Use as a context
+manager, so that the container is removed afterwards:
+
+    with AdminSession(path) as session:
+        session.add_users(["a@example.com"])
+        session.grant("a@example.com", ["*/reports.read"])
+"""
+    # Keeps the container alive until it is stopped, without relying
+    # on anything beyond a posix shell being present in the image
+    KEEPALIVE = "trap 'exit 0' TERM INT; tail -f /dev/null & wait"
+
+    def __init__(self, path):
+        self.cfg = fetch_config(path)
+        self.container = None
+        self.entrypoint = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        image = str(self.cfg.images["admin"])
+        mounts = [docker.types.Mount("/orderly", self.cfg.volumes["orderly"])]
+        # 'docker run' would pull the image if needed, so we do too
+        docker_util.ensure_image("admin", image)
+        with docker_client() as cl:
+            config = cl.images.get(image).attrs["Config"]
+            self.entrypoint = image_entrypoint(image, config)
+            self.container = cl.containers.run(
+                image, [self.KEEPALIVE], entrypoint=["sh", "-c"],
+                mounts=mounts, detach=True)
+
+    def stop(self):
+        if self.container is not None:
+            with docker_util.ignoring_missing():
+                self.container.remove(force=True)
+            self.container = None
+
+    def exec(self, args):
+        if self.container is None:
+            raise Exception("Admin session is not running")
+        res = self.container.exec_run(self.entrypoint + args)
+        return {"args": args,
+                "output": res[1].decode("UTF-8"),
+                "status": res[0]}
+
+    def run(self, args):
+        result = self.exec(args)["output"]
         print(result)
         return result
+
+    def add_users(self, emails):
+        return self.run(["add-users"] + emails)
+
+    def add_groups(self, names):
+        return self.run(["add-groups"] + names)
+
+    def add_members(self, name, emails):
+        return self.run(["add-members", name] + emails)
+
+    def grant(self, name, permissions):
+        return self.run(["grant", name] + permissions)
+
+
+def image_entrypoint(image, config):
+    """The command to prefix arguments with, to run them as 'docker run
+<image> <args>' would.  With no entrypoint the arguments are the whole
+command.  An entrypoint in shell form ('sh -c <cmd>') ignores
+arguments, so can't be used to run admin commands."""
+    entrypoint = config.get("Entrypoint")
+    if not entrypoint:
+        return []
+    if isinstance(entrypoint, str) or \
+            len(entrypoint) == 3 and entrypoint[1] == "-c" and \
+            os.path.basename(entrypoint[0]) in ("sh", "bash"):
+        msg = "Admin image '{}' has a shell form entrypoint".format(image)
+        raise Exception(msg)
+    return list(entrypoint)
+
+
+def operation_args(operation):
+    if not isinstance(operation, dict) or len(operation) != 1:
+        msg = "Invalid admin operation {!r}: expected a single entry".format(
+            operation)
+        raise Exception(msg)
+    (cmd, value), = operation.items()
+    if cmd in ("add-users", "add-groups"):
+        args = [cmd] + as_list(value)
+    elif cmd == "add-members":
+        args = [cmd, value["group"]] + as_list(value["emails"])
+    elif cmd == "grant":
+        args = [cmd, value["group"]] + as_list(value["permissions"])
+    else:
+        raise Exception("Unknown admin operation '{}'".format(cmd))
+    return [str(x) for x in args]
+
+
+def as_list(x):
+    return x if isinstance(x, list) else [x]
+
+
+def report(results):
+    for i, x in enumerate(results):
+        result = "ok" if x["status"] == 0 else "FAILED"
+        print("[{}/{}] {}: {}".format(
+            i + 1, len(results), " ".join(x["args"]), result))
+        if x["output"]:
+            print("\n".join("    " + y for y in x["output"].splitlines()))
@@ -0,0 +1,65 @@
+import hashlib
+import io
+
+from orderly_web.cache import cache_read, cache_write
+
+# Static assets (logo and favicon) that are copied into the web
+# container.  These are prepared in memory, and the converted favicon
+# is cached on the host keyed by the hash of its source image, so that
+# we only pay for conversion when the source changes.
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def web_assets(cfg):
+    """Return a dictionary of container path to file contents for the
+web container's static assets"""
+    assets = {}
+    if cfg.logo_name is not None:
+        path = "/static/public/img/logo/{}".format(cfg.logo_name)
+        assets[path] = read_bytes(cfg.logo_path)
+    if cfg.favicon_path is not None:
+        assets["/static/public/favicon.ico"] = favicon(cfg.favicon_path)
+    return assets
+
+
+def favicon(source):
+    data = read_bytes(source)
+    key = "favicon-{}".format(sha256(data))
+    ret = cache_read(key)
+    if ret is None:
+        # PIL is slow to import and only needed here
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.open(io.BytesIO(data)).save(buf, format="ico")
+        ret = buf.getvalue()
+        cache_write(key, ret)
+    return ret
+
+
+def assets_stage(container, files, assets):
+    """Add assets to a ContainerFiles object, skipping any that are
+already present in the container with the same contents"""
+    if not assets:
+        return
+    paths = sorted(assets.keys())
+    # sha256sum exits with an error if any file is missing, but still
+    # reports the hashes of the ones that are present
+    res = container.exec_run(["sha256sum"] + paths)
+    existing = {}
+    for line in res[1].decode("UTF-8").splitlines():
+        parts = line.split(maxsplit=1)
+        if len(parts) == 2:
+            existing[parts[1].strip()] = parts[0]
+    for p in paths:
+        if existing.get(p) == sha256(assets[p]):
+            print("[web] {} is up to date".format(p))
+        else:
+            files.bytes(p, assets[p])
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,117 @@
+import copy
+
+import constellation.docker_util as docker_util
+
+from orderly_web.docker_helpers import container_http_status, docker_client, \
+    wait_for
+from orderly_web.errors import OrderlyWebConfigError
+
+# Replacing the web container without downtime: a second web container
+# is started and configured alongside the live one, the proxy is
+# pointed at it once it is serving requests, and then the old
+# container is removed (once the requests in flight to it have
+# finished) and the new one takes over its name.
+WEB_READY_TIMEOUT = 300
+# OrderlyWeb serves its api index without needing to log in
+WEB_READY_PATH = "/api/v2"
+WEB_DRAIN_TIMEOUT = 60
+
+
+def blue_green_check(cfg):
+    if not cfg.proxy_enabled:
+        raise OrderlyWebConfigError("Blue/green upgrade requires the proxy")
+    if cfg.web_dev_mode:
+        msg = "Blue/green upgrade is not possible with web dev_mode"
+        raise OrderlyWebConfigError(msg)
+
+
+def web_blue_green(obj, cfg):
+    web = obj.containers.find(cfg.containers["web"])
+    proxy = obj.containers.find(cfg.containers["proxy"]).get(obj.prefix)
+    if proxy is None:
+        raise Exception("The proxy is not running")
+    live = web.name_external(obj.prefix)
+    aliases = network_aliases(web.get(obj.prefix), cfg.network)
+    nxt = copy.copy(web)
+    nxt.name = "{}-next".format(web.name)
+    nxt.remove(obj.prefix)
+
+    print("[web] Starting {} alongside {}".format(
+        nxt.name_external(obj.prefix), live))
+    live_upstream = upstream(live, cfg)
+    nxt_upstream = upstream(nxt.name_external(obj.prefix), cfg)
+    try:
+        nxt.start(obj.prefix, obj.network, obj.volumes, cfg)
+        container = nxt.get(obj.prefix)
+        wait_for(lambda: web_ready(container, cfg),
+                 "new web container", WEB_READY_TIMEOUT)
+        # Other containers may reach web by the aliases that the old
+        # container has; the new one shares them until that is removed
+        network_reconnect(container, cfg.network, aliases)
+        proxy_switch_upstream(proxy, live_upstream, nxt_upstream)
+    except Exception:
+        nxt.stop(obj.prefix, True)
+        nxt.remove(obj.prefix)
+        raise
+
+    print("[web] Draining {}".format(live))
+    try:
+        wait_for(lambda: not proxy_draining(proxy),
+                 "requests to {}".format(live), WEB_DRAIN_TIMEOUT)
+    except Exception as e:
+        print("[web] {}; stopping it anyway".format(e))
+    web.stop(obj.prefix)
+    web.remove(obj.prefix)
+    container.rename(live)
+    # The proxy has already resolved the address of the new container,
+    # so continues to reach it after the rename until we switch back
+    proxy_switch_upstream(proxy, nxt_upstream, live_upstream)
+
+
+def web_ready(container, cfg):
+    return container_http_status(container, cfg.web_port,
+                                 WEB_READY_PATH) == 200
+
+
+def network_aliases(container, network):
+    """Aliases of the container on the network, other than the short id
+that docker adds itself"""
+    settings = container.attrs["NetworkSettings"]["Networks"][network]
+    return [x for x in settings.get("Aliases") or []
+            if x != container.id[:12]]
+
+
+def network_reconnect(container, network, aliases):
+    print("[web] Connecting {} to {} as {}".format(
+        container.name, network, ", ".join(aliases)))
+    with docker_client() as cl:
+        nw = cl.networks.get(network)
+        nw.disconnect(container)
+        nw.connect(container, aliases=aliases)
+
+
+def proxy_draining(proxy):
+    """Whether any nginx worker from before the last reload is still
+finishing its requests.  Old workers are renamed by nginx, which we
+look for in /proc as the proxy image may not have ps; the '[d]' stops
+the pattern matching the command line of grep itself"""
+    cmd = "grep -qs 'worker process is shutting [d]own' /proc/[0-9]*/cmdline"
+    return proxy.exec_run(["sh", "-c", cmd])[0] == 0
+
+
+def upstream(name, cfg):
+    return "{}:{}".format(name, cfg.web_port)
+
+
+def proxy_switch_upstream(proxy, old, new):
+    """Point the proxy at a different web container by rewriting the
+upstream address in its nginx configuration and reloading it; nginx
+lets requests in flight finish on the old upstream"""
+    print("[proxy] Switching upstream from {} to {}".format(old, new))
+    # Container names can only contain [a-zA-Z0-9_.-] so need no
+    # quoting, but '.' must be escaped for sed
+    script = ("files=$(grep -rlF '{old}' /etc/nginx) && "
+              "sed -i 's/{pattern}/{new}/g' $files && "
+              "nginx -t && nginx -s reload").format(
+                  old=old, pattern=old.replace(".", "\\."), new=new)
+    docker_util.exec_safely(proxy, ["sh", "-c", script])
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import time
+
+# A small host-side cache for things that are expensive to recompute
+# between runs.  Entries may contain secrets, so the directory is only
+# readable by the user and files are written with mode 0600.  Failure
+# to read or write the cache is never an error, we just recompute.
+
+
+def cache_dir():
+    path = os.environ.get("ORDERLY_WEB_CACHE") or \
+        os.path.join(os.path.expanduser("~"), ".cache", "orderly-web")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    # makedirs does not change the mode of an existing directory
+    os.chmod(path, 0o700)
+    return path
+
+
+def cache_read(name, ttl=None):
+    try:
+        path = os.path.join(cache_dir(), name)
+        if ttl is not None and time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def cache_write(name, data):
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+    try:
+        path = os.path.join(cache_dir(), name)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        print("Could not write '{}' to cache: {}".format(name, e))
+
+
+def cache_evict(prefix, keep):
+    """Remove all but the 'keep' most recently written entries whose
+names start with 'prefix'"""
+    try:
+        path = cache_dir()
+        names = [x for x in os.listdir(path) if x.startswith(prefix)]
+        names.sort(key=lambda x: os.path.getmtime(os.path.join(path, x)),
+                   reverse=True)
+        for x in names[keep:]:
+            os.remove(os.path.join(path, x))
+    except OSError:
+        pass
@@ -1,12 +1,19 @@
 """Usage:
   orderly-web start <path> [--extra=PATH] [--option=OPTION]... [--pull]
-  orderly-web status <path>
+    [--force-migrate] [--trace=PATH]
+  orderly-web upgrade <path> [--extra=PATH] [--option=OPTION]... [--pull]
+    [--component=NAME]... [--blue-green]
+  orderly-web scale <path> <workers>
+  orderly-web status <path> [--json] [--watch]
+  orderly-web health <path> [--json] [--timeout=SECONDS]
   orderly-web stop <path> [--volumes] [--network] [--kill] [--force]
     [--extra=PATH] [--option=OPTION]...
   orderly-web admin <path> add-users <email>...
   orderly-web admin <path> add-groups <name>...
   orderly-web admin <path> add-members <group> <email>...
   orderly-web admin <path> grant <group> <permission>...
+  orderly-web admin <path> apply <file>
+  orderly-web admin <path> sync <file> [--dry-run]
 
 Options:
   --extra=PATH     Path, relative to <path>, of yml file of additional
@@ -15,6 +22,19 @@ Options:
                    Use dots in key for hierarchical structure, e.g., a.b=value
                    This argument may be repeated to provide multiple arguments
   --pull           Pull images before starting
+  --force-migrate  Migrate the web tables even if they appear up to date
+  --trace=PATH     Write the time taken by each phase of the deploy to a
+                   file in Chrome's trace format
+  --component=NAME  Recreate this component (e.g., web) and those that
+                   depend on it, even if its configuration is unchanged.
+                   This argument may be repeated
+  --blue-green     Replace the web container without downtime, by starting
+                   the new one alongside the old and switching the proxy
+  --json           Report as json (status includes uptime, restarts and
+                   image digests)
+  --watch          Report changes in container state as they happen
+  --timeout=SECONDS  Time to allow each health check [default: 5]
+  --dry-run        Report the changes that would be made, without making them
   --volumes        Remove volumes (WARNING: irreversible data loss)
   --network        Remove network
   --kill           Kill the containers (faster, but possible db corruption)
@@ -25,7 +45,6 @@ Options:
 """
 
 import docopt
-import yaml
 
 import orderly_web
 
@@ -42,11 +61,27 @@ def parse_args(argv):
         extra = args["--extra"]
         options = parse_option(args)
         pull_images = args["--pull"]
+        force_migrate = args["--force-migrate"]
+        trace = args["--trace"]
         target = orderly_web.start
-        args = (path, extra, options, pull_images)
+        args = (path, extra, options, pull_images, force_migrate, trace)
+    elif args["upgrade"]:
+        extra = args["--extra"]
+        options = parse_option(args)
+        pull_images = args["--pull"]
+        components = args["--component"]
+        blue_green = args["--blue-green"]
+        target = orderly_web.upgrade
+        args = (path, extra, options, pull_images, components, blue_green)
+    elif args["scale"]:
+        target = orderly_web.scale
+        args = (path, parse_workers(args["<workers>"]))
     elif args["status"]:
         target = orderly_web.status
-        args = (path, )
+        args = (path, args["--json"], args["--watch"])
+    elif args["health"]:
+        target = orderly_web.health
+        args = (path, args["--json"], parse_timeout(args["--timeout"]))
     elif args["stop"]:
         kill = args["--kill"]
         network = args["--network"]
@@ -65,6 +100,20 @@ def parse_option(args):
     return [string_to_dict(x) for x in args["--option"]]
 
 
+def parse_workers(x):
+    try:
+        return int(x)
+    except ValueError:
+        raise Exception("Invalid number of workers '{}'".format(x))
+
+
+def parse_timeout(x):
+    try:
+        return float(x)
+    except ValueError:
+        raise Exception("Invalid timeout '{}'".format(x))
+
+
 def parse_admin_args(args):
     path = args["<path>"]
     if args["add-users"]:
@@ -79,6 +128,12 @@ def parse_admin_args(args):
     elif args["grant"]:
         target = orderly_web.grant
         args = (path, args["<group>"], args["<permission>"])
+    elif args["apply"]:
+        target = orderly_web.apply_file
+        args = (path, args["<file>"])
+    elif args["sync"]:
+        target = orderly_web.sync_permissions
+        args = (path, args["<file>"], args["--dry-run"])
     return target, args
 
 
@@ -100,6 +155,7 @@ def string_to_dict(string):
 
 
 def yaml_atom_parse(x):
+    import yaml
     ret = yaml.load(x, Loader=yaml.Loader)
     if type(ret) not in [bool, int, float, str]:
         raise Exception("Invalid value '{}' - expected simple type".format(x))
@@ -1,5 +1,9 @@
 import base64
+import functools
+import hashlib
+import json
 import os
+import re
 
 import docker
 import pickle
@@ -8,8 +12,13 @@ import constellation
 import constellation.docker_util as docker_util
 import constellation.config as config
 import constellation.vault as vault
+from constellation.__about__ import __version__ as constellation_version
 
+from orderly_web.__about__ import __version__
+from orderly_web.cache import cache_evict, cache_read, cache_write
 from orderly_web.docker_helpers import docker_client
+from orderly_web.errors import OrderlyWebConfigError
+from orderly_web.vault import vault_resolve
 
 # There are two types of configuration objects and three ways that
 # they turn up.  These are:
@@ -29,9 +38,10 @@ from orderly_web.docker_helpers import docker_client
 #       also do-able in one step with `build_config`
 #
 #    b. The `fetch()` method of the `OrderlyWebConfigBase` object,
-#       which retrieves a pickled configuration object from the
+#       which retrieves a serialised configuration object from the
 #       running orderly container (which stores all the options as
-#       used when starting).  Also doable with `fetch_config`
+#       used when starting).  Also doable with `fetch_config`.  See
+#       `config_serialise` for the format.
 #
 # The idea here is that interacting with an existing set of containers
 # (currently limited to status and stop, but eventually we will
@@ -48,11 +58,74 @@ PATH_CONFIG = {"container": "orderly", "path": "/orderly-web-config"}
 
 
 def read_config(path):
-    return OrderlyWebConfigBase(path)
+    return config_cached("base", path, None, None,
+                         lambda: OrderlyWebConfigBase(path))
 
 
 def build_config(path, extra=None, options=None):
-    return read_config(path).build(extra, options)
+    return config_cached("build", path, extra, options,
+                         lambda: read_config(path).build(extra, options))
+
+
+# Reading and validating the configuration is repeated by every
+# command, so we keep the compiled configuration objects in the host
+# cache, keyed by everything that goes into them: the yml files, any
+# options and environment variables that the yml refers to.  The
+# layout of the objects is determined by this file and by the
+# constellation package, so the key also includes a hash of this file,
+# the version of constellation and CONFIG_CACHE_SCHEMA (to be
+# increased if anything else changes the layout).  Only the most
+# recently written CONFIG_CACHE_SIZE entries are kept.
+CONFIG_CACHE_SCHEMA = 1
+CONFIG_CACHE_SIZE = 32
+
+
+def config_cached(kind, path, extra, options, create):
+    key = config_cache_key(kind, path, extra, options)
+    expected = OrderlyWebConfigBase if kind == "base" else OrderlyWebConfig
+    if key is not None:
+        dat = cache_read(key)
+        if dat is not None:
+            try:
+                entry = pickle.loads(dat)
+                cfg = entry["config"]
+                if entry["schema"] == CONFIG_CACHE_SCHEMA and \
+                        type(cfg) is expected:
+                    cfg.path = path
+                    return cfg
+            except Exception:
+                pass
+    cfg = create()
+    if key is not None:
+        entry = {"schema": CONFIG_CACHE_SCHEMA, "config": cfg}
+        cache_write(key, pickle.dumps(entry))
+        cache_evict("config-", CONFIG_CACHE_SIZE)
+    return cfg
+
+
+@functools.lru_cache(maxsize=None)
+def config_code_hash():
+    with open(__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def config_cache_key(kind, path, extra, options):
+    filenames = ["orderly-web"] if extra is None else ["orderly-web", extra]
+    parts = [str(CONFIG_CACHE_SCHEMA), __version__, config_code_hash(),
+             constellation_version, os.path.abspath(path),
+             json.dumps([extra, options], sort_keys=True, default=str)]
+    for f in filenames:
+        try:
+            with open("{}/{}.yml".format(path, f)) as con:
+                txt = con.read()
+        except OSError:
+            # Let the usual code report the error
+            return None
+        parts.append(txt)
+        for v in re.findall("\\$([0-9A-Z_]+)", txt):
+            parts.append(os.environ.get(v, ""))
+    h = hashlib.sha256("\0".join(parts).encode("UTF-8"))
+    return "config-{}-{}".format(kind, h.hexdigest())
 
 
 def fetch_config(path):
@@ -90,18 +163,119 @@ class OrderlyWebConfigBase:
                     "{}-{}".format(self.container_prefix, name))
         except docker.errors.NotFound:
             return None
-        path = PATH_CONFIG["path"]
-        txt = docker_util.string_from_container(container, path)
-        cfg = pickle.loads(base64.b64decode(txt))
+        key = fetched_config_key(container)
+        txt = cache_read(key)
+        if txt is None:
+            path = PATH_CONFIG["path"]
+            txt = docker_util.string_from_container(container, path)
+            fetched_config_write(container, txt)
+        else:
+            txt = txt.decode("UTF-8")
         # We have to set the path because the relative path (or even
         # absolute path) might be different between different users of
         # the same configuration, as the docker container is a global
         # resource.
-        cfg.path = self.path
+        return config_deserialise(txt, self.path)
+
+
+# Fetching the configuration out of the orderly container needs a
+# round trip through a docker archive, so we also keep a copy in the
+# host cache.  This is keyed by the identity of the orderly container
+# (its id and the time it was started) which we already have from
+# looking the container up, so that a restarted or replaced container
+# is always read afresh.  save() updates the cached copy; if the
+# configuration is re-saved from another machine without restarting
+# the container then this machine will not see the change.  The
+# configuration contains secrets, which is why the cache is only
+# readable by the user, and why we keep only the latest copy for each
+# deployment (identified by the name of the orderly container).
+def fetched_config_key(container):
+    identity = "{} {}".format(container.attrs["Id"],
+                              container.attrs["State"]["StartedAt"])
+    return fetched_config_prefix(container) + \
+        hashlib.sha256(identity.encode("UTF-8")).hexdigest()
+
+
+def fetched_config_prefix(container):
+    name = hashlib.sha256(container.name.encode("UTF-8")).hexdigest()
+    return "fetched-{}-".format(name[:16])
+
+
+def fetched_config_write(container, txt):
+    cache_evict(fetched_config_prefix(container), 0)
+    cache_write(fetched_config_key(container), txt)
+
+
+# The configuration is stored in the orderly container as json, with
+# a format version, and with each field of the configuration object
+# stored as its own json string.  Fields are only decoded when first
+# used, so commands that need only a few fields (e.g., the container
+# names) do not pay for decoding the rest.  The raw configuration data
+# is not stored, as everything we need has been extracted from it.
+CONFIG_FORMAT_VERSION = 1
+CONFIG_NOT_SERIALISED = ["path", "data", "_fields", "web_force_migrate"]
+
+
+def config_serialise(cfg):
+    fields = dict(vars(cfg).get("_fields", {}))
+    for k, v in vars(cfg).items():
+        if k not in CONFIG_NOT_SERIALISED:
+            fields[k] = json.dumps(config_encode_value(v),
+                                   separators=(",", ":"))
+    return json.dumps({"version": CONFIG_FORMAT_VERSION, "fields": fields},
+                      separators=(",", ":"), sort_keys=True)
+
+
+def config_deserialise(txt, path):
+    if not txt.startswith("{"):
+        # Configuration pickled by older versions of orderly-web
+        cfg = pickle.loads(base64.b64decode(txt))
+        cfg.path = path
         return cfg
+    dat = json.loads(txt)
+    if dat.get("version") != CONFIG_FORMAT_VERSION:
+        msg = ("Configuration was saved in format version {}, but this"
+               " version of orderly-web reads format version {}. You should"
+               " force a stop and restart.").format(
+                   dat.get("version"), CONFIG_FORMAT_VERSION)
+        raise OrderlyWebConfigError(msg)
+    cfg = OrderlyWebConfig.__new__(OrderlyWebConfig)
+    cfg.path = path
+    cfg._fields = dat["fields"]
+    return cfg
+
+
+def config_encode_value(x):
+    if isinstance(x, constellation.ImageReference):
+        return {"__image__": [x.repo, x.name, x.tag]}
+    if isinstance(x, vault.VaultConfig):
+        return {"__vault__": [x.url, x.auth_method, x.auth_args]}
+    if isinstance(x, dict):
+        return {k: config_encode_value(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [config_encode_value(v) for v in x]
+    if x is None or isinstance(x, (str, int, float, bool)):
+        return x
+    raise TypeError("Can't serialise configuration value {!r}".format(x))
+
+
+def config_decode_value(x):
+    if isinstance(x, dict):
+        if "__image__" in x:
+            return constellation.ImageReference(*x["__image__"])
+        if "__vault__" in x:
+            return vault.VaultConfig(*x["__vault__"])
+        return {k: config_decode_value(v) for k, v in x.items()}
+    if isinstance(x, list):
+        return [config_decode_value(v) for v in x]
+    return x
 
 
 class OrderlyWebConfig:
+    # Not read from the configuration, and not saved with it; set by
+    # start(force_migrate=True) for that deploy only
+    web_force_migrate = False
+
     def __init__(self, path, dat):
         self.path = path
         self.data = dat
@@ -116,6 +290,9 @@ class OrderlyWebConfig:
 
         self.workers = config.config_integer(
             self.data, ["orderly", "workers"], is_optional=True, default=1)
+        # 'scale' changes the number of workers that are running, so we
+        # also keep the number that was configured
+        self.workers_configured = self.workers
 
         # 1. Redis
         self.redis_name = config.config_string(
@@ -255,6 +432,8 @@ class OrderlyWebConfig:
         self.orderly_env = config.config_dict(dat, ["orderly", "env"], True)
         self.orderly_expose = config.config_boolean(dat, ["orderly", "expose"],
                                                     True, False)
+        self.orderly_ready_timeout = config.config_integer(
+            dat, ["orderly", "ready_timeout"], True, 60)
 
         self.web_dev_mode = config.config_boolean(
             dat, ["web", "dev_mode"], True)
@@ -360,17 +539,34 @@ class OrderlyWebConfig:
             else:
                 raise Exception("web_url must be provided")
 
+        # known_hosts is optional; if not given it is scanned at deploy
+        ssh_keys = ["public", "private"]
+        if config.config_string(
+                dat, ["orderly", "ssh", "known_hosts"], True) is not None:
+            ssh_keys.append("known_hosts")
         self.orderly_ssh = config.config_dict_strict(
-            dat, ["orderly", "ssh"], ["public", "private"], True)
+            dat, ["orderly", "ssh"], ssh_keys, True)
 
         self.orderly_initial_source = None
         self.orderly_initial_url = None
+        self.orderly_initial_depth = None
+        self.orderly_initial_branch = None
+        self.orderly_initial_reference = None
         if "initial" in dat["orderly"] and dat["orderly"]["initial"]:
             self.orderly_initial_source = config.config_enum(
                 dat, ["orderly", "initial", "source"], ["demo", "clone"])
             if self.orderly_initial_source == "clone":
                 self.orderly_initial_url = config.config_string(
                     dat, ["orderly", "initial", "url"])
+                self.orderly_initial_depth = config.config_integer(
+                    dat, ["orderly", "initial", "depth"], True)
+                self.orderly_initial_branch = config.config_string(
+                    dat, ["orderly", "initial", "branch"], True)
+                reference = config.config_string(
+                    dat, ["orderly", "initial", "reference"], True)
+                if reference is not None:
+                    self.orderly_initial_reference = \
+                        self.get_abs_path(reference)
             elif "url" in dat["orderly"]["initial"]:
                 # I think an error is a bit harsh
                 print("NOTE: Ignoring orderly:initial:url")
@@ -379,11 +575,25 @@ class OrderlyWebConfig:
                                                       ["slack", "webhook_url"],
                                                       True)
 
+    def __getattr__(self, name):
+        # Only called for attributes that are not already set; for a
+        # deserialised configuration decode the field on first use.
+        # The encoded field is left in place, as configure hooks run on
+        # many threads at once and two may decode the same field (which
+        # is harmless, unlike one finding it missing).
+        fields = self.__dict__.get("_fields")
+        if fields is None or name not in fields:
+            raise AttributeError(name)
+        value = config_decode_value(json.loads(fields[name]))
+        setattr(self, name, value)
+        return value
+
     def save(self):
-        txt = base64.b64encode(pickle.dumps(self)).decode("utf8")
+        txt = config_serialise(self)
         container = self.get_container(PATH_CONFIG["container"])
         path = PATH_CONFIG["path"]
         docker_util.string_into_container(txt, container, path)
+        fetched_config_write(container, txt)
 
     def get_container(self, name):
         with docker_client() as cl:
@@ -391,13 +601,20 @@ class OrderlyWebConfig:
                                                     self.containers[name]))
 
     def resolve_secrets(self):
-        vault_client = self.vault.client()
-        vault.resolve_secrets(self.orderly_env, vault_client)
-        vault.resolve_secrets(self.web_auth_github_app, vault_client)
-        vault.resolve_secrets(self.orderly_ssh, vault_client)
-        if self.slack_webhook_url is not None:
-            _, self.slack_webhook_url = vault.resolve_secret(
-                self.slack_webhook_url, vault_client)
+        vault_resolve(self, self.vault)
+
+    def record_files(self):
+        # Files that the web configuration refers to can be edited
+        # without changing the yml, so we save hashes of their contents
+        # with the configuration for upgrade to compare.  This is done
+        # for each deploy, as built configurations are cached.
+        self.web_file_hashes = {}
+        for f in ["logo_path", "favicon_path", "sass_variables"]:
+            path = getattr(self, f)
+            if path is not None:
+                with open(path, "rb") as con:
+                    self.web_file_hashes[f] = \
+                        hashlib.sha256(con.read()).hexdigest()
 
     def get_abs_path(self, relative_path):
         return os.path.abspath(os.path.join(self.path, relative_path))
@@ -1,14 +1,25 @@
+import hashlib
 import os
-import tempfile
+import threading
 import docker
-import time
-
-from PIL import Image
 
 import constellation
 import constellation.docker_util as docker_util
 
-from orderly_web.docker_helpers import docker_client
+from orderly_web.assets import assets_stage, web_assets
+from orderly_web.cache import cache_read, cache_write
+from orderly_web.docker_helpers import ContainerFiles, container_port_open, \
+    docker_client, wait_for
+from orderly_web.schedule import depends_on
+from orderly_web.timing import span
+
+# ssh host keys for github are scanned at most once per day, and then
+# shared by the orderly container and all the workers
+KNOWN_HOSTS_TTL = 24 * 60 * 60
+KNOWN_HOSTS_LOCK = threading.Lock()
+
+# Where a local reference repository for the initial clone is mounted
+ORDERLY_REFERENCE = "/orderly-reference"
 
 
 def orderly_constellation(cfg):
@@ -50,7 +61,7 @@ def outpack_server_container(cfg):
     mounts = [constellation.ConstellationVolumeMount("outpack", "/outpack")]
     outpack_server = constellation.ConstellationContainer(
         name, cfg.outpack_ref, mounts=mounts)
-    return outpack_server
+    return depends_on(outpack_server, cfg.containers["outpack-migrate"])
 
 
 def outpack_migrate_container(cfg):
@@ -60,7 +71,7 @@ def outpack_migrate_container(cfg):
     args = ["/orderly", "/outpack", "--minutes=5"]
     outpack_migrate = constellation.ConstellationContainer(
         name, cfg.outpack_migrate_ref, mounts=mounts, args=args)
-    return outpack_migrate
+    return depends_on(outpack_migrate, cfg.containers["orderly"])
 
 
 def packit_db_container(cfg):
@@ -71,7 +82,8 @@ def packit_db_container(cfg):
 
 
 def packit_db_configure(container, cfg):
-    docker_util.exec_safely(container, ["wait-for-db"])
+    with span("packit-db wait"):
+        docker_util.exec_safely(container, ["wait-for-db"])
 
 
 def packit_api_container(cfg):
@@ -93,14 +105,14 @@ def packit_api_container(cfg):
 
     packit_api = constellation.ConstellationContainer(
         name, cfg.packit_api_ref, environment=env)
-    return packit_api
+    return depends_on(packit_api, packit_db, outpack)
 
 
 def packit_container(cfg):
     name = cfg.containers["packit"]
     packit = constellation.ConstellationContainer(
         name, cfg.packit_app_ref)
-    return packit
+    return depends_on(packit, cfg.containers["packit-api"])
 
 
 def redis_container(cfg):
@@ -120,16 +132,21 @@ def get_static_file(filename):
 
 def redis_configure(container, cfg):
     print("[redis] Waiting for redis to come up")
-    redis_script = get_static_file("wait_for_redis")
-    docker_util.file_into_container(
-        redis_script, container, ".", "wait_for_redis")
-    docker_util.exec_safely(container, ["bash", "/wait_for_redis"])
+    files = ContainerFiles()
+    files.file("/wait_for_redis", get_static_file("wait_for_redis"))
+    files.put(container)
+    with span("redis wait"):
+        docker_util.exec_safely(container, ["bash", "/wait_for_redis"])
 
 
 def orderly_container(cfg, redis_container):
     orderly_name = cfg.containers["orderly"]
     orderly_args = ["--port", "8321", "--go-signal", "/go_signal", "/orderly"]
     orderly_mounts = [constellation.ConstellationVolumeMount("orderly", "/orderly")]
+    if orderly_reference_needed(cfg):
+        orderly_mounts.append(constellation.ConstellationBindMount(
+            cfg.orderly_initial_reference, ORDERLY_REFERENCE,
+            read_only=True))
     ports = [8321] if cfg.orderly_expose else None
     environment = orderly_env(cfg, redis_container)
     orderly = constellation.ConstellationContainer(
@@ -137,17 +154,34 @@ def orderly_container(cfg, redis_container):
         mounts=orderly_mounts, environment=environment,
         configure=orderly_configure, working_dir="/orderly",
         ports=ports)
-    return orderly
+    return depends_on(orderly, redis_container.name)
+
+
+def orderly_reference_needed(cfg):
+    """The reference repository is only used for the initial clone, so
+it is mounted only while there is no orderly volume, and only if it
+still exists, so that later starts do not depend on it"""
+    path = cfg.orderly_initial_reference
+    if path is None or not os.path.isdir(path):
+        return False
+    with docker_client() as cl:
+        try:
+            cl.volumes.get(cfg.volumes["orderly"])
+            return False
+        except docker.errors.NotFound:
+            return True
 
 
 def orderly_configure(container, cfg):
-    orderly_write_ssh_keys(cfg.orderly_ssh, container)
-    orderly_initial_data(cfg, container)
-    orderly_check_schema(container)
+    with span("orderly ssh"):
+        orderly_write_ssh_keys(cfg.orderly_ssh, container)
+    with span("orderly init"):
+        orderly_initial_data(cfg, container)
+    with span("orderly rebuild"):
+        orderly_check_schema(container)
     orderly_start(container)
-    # This is gross but wait a little for orderly to backup db before
-    # starting outpack server
-    time.sleep(5)
+    with span("orderly wait"):
+        orderly_wait_ready(container, cfg)
 
 
 def orderly_initial_data(cfg, container):
@@ -158,7 +192,7 @@ def orderly_initial_data(cfg, container):
         if cfg.orderly_initial_source == "demo":
             orderly_init_demo(container)
         elif cfg.orderly_initial_source == "clone":
-            orderly_init_clone(container, cfg.orderly_initial_url)
+            orderly_init_clone(container, cfg)
         else:
             raise Exception("Orderly volume not initialised")
 
@@ -170,12 +204,31 @@ def orderly_init_demo(container):
     docker_util.exec_safely(container, args)
 
 
-def orderly_init_clone(container, url):
+def orderly_init_clone(container, cfg):
     print("[orderly] Initialising orderly by cloning")
-    args = ["git", "clone", url, "/orderly"]
+    args = ["git", "clone"]
+    if cfg.orderly_initial_depth is not None:
+        args += ["--depth", str(cfg.orderly_initial_depth)]
+    if cfg.orderly_initial_branch is not None:
+        args += ["--branch", cfg.orderly_initial_branch, "--single-branch"]
+    if cfg.orderly_initial_reference is not None:
+        if orderly_has_reference(container):
+            # The reference repository is only mounted into the orderly
+            # container, but the workers and web use the same volume, so
+            # the objects must be copied rather than left as alternates.
+            args += ["--reference", ORDERLY_REFERENCE, "--dissociate"]
+        else:
+            print("[orderly] Reference repository not available - "
+                  "cloning without it")
+    args += [cfg.orderly_initial_url, "/orderly"]
     docker_util.exec_safely(container, args)
 
 
+def orderly_has_reference(container):
+    res = container.exec_run(["test", "-d", ORDERLY_REFERENCE])
+    return res[0] == 0
+
+
 def orderly_is_initialised(container):
     res = container.exec_run(["stat", "/orderly/orderly_config.yml"])
     return res[0] == 0
@@ -191,18 +244,28 @@ def orderly_write_ssh_keys(orderly_ssh, container):
     if not orderly_ssh:
         return
     print("[orderly] Configuring ssh")
-    path_private = "/root/.ssh/id_rsa"
-    path_public = "/root/.ssh/id_rsa.pub"
-    path_known_hosts = "/root/.ssh/known_hosts"
-    docker_util.exec_safely(container, ["mkdir", "-p", "/root/.ssh"])
-    docker_util.string_into_container(
-        orderly_ssh["private"], container, path_private)
-    docker_util.string_into_container(
-        orderly_ssh["public"], container, path_public)
-    docker_util.exec_safely(container, ["chmod", "600", path_private])
-    hosts = docker_util.exec_safely(container, ["ssh-keyscan", "github.com"])
-    docker_util.string_into_container(hosts[1].decode("UTF-8"), container,
-                                      path_known_hosts)
+    hosts = orderly_known_hosts(orderly_ssh, container)
+    files = ContainerFiles()
+    files.directory("/root/.ssh", 0o700)
+    files.string("/root/.ssh/id_rsa", orderly_ssh["private"], 0o600)
+    files.string("/root/.ssh/id_rsa.pub", orderly_ssh["public"])
+    files.string("/root/.ssh/known_hosts", hosts)
+    files.put(container)
+
+
+def orderly_known_hosts(orderly_ssh, container):
+    if "known_hosts" in orderly_ssh:
+        return orderly_ssh["known_hosts"]
+    with KNOWN_HOSTS_LOCK:
+        hosts = cache_read("known_hosts", KNOWN_HOSTS_TTL)
+        if hosts:
+            return hosts.decode("UTF-8")
+        print("[orderly] Scanning ssh host keys for github.com")
+        res = docker_util.exec_safely(container, ["ssh-keyscan", "github.com"])
+        hosts = res[1].decode("UTF-8")
+        if hosts.strip():
+            cache_write("known_hosts", hosts)
+        return hosts
 
 
 def orderly_start(container):
@@ -210,6 +273,14 @@ def orderly_start(container):
     docker_util.exec_safely(container, ["touch", "/go_signal"])
 
 
+def orderly_wait_ready(container, cfg):
+    # orderly.server backs up the db before it starts listening, and
+    # the backup must be complete before the outpack server starts
+    print("[orderly] Waiting for orderly server to come up")
+    wait_for(lambda: container_port_open(container, 8321),
+             "orderly server", cfg.orderly_ready_timeout)
+
+
 def worker_container(cfg, redis_container):
     worker_name = cfg.containers["orderly-worker"]
     worker_args = ["--go-signal", "/go_signal"]
@@ -221,11 +292,13 @@ def worker_container(cfg, redis_container):
         args=worker_args, mounts=worker_mounts, environment=environment,
         entrypoint=worker_entrypoint, configure=worker_configure,
         working_dir="/orderly")
-    return worker
+    return depends_on(worker, redis_container.name,
+                      cfg.containers["orderly"])
 
 
 def worker_configure(container, cfg):
-    orderly_write_ssh_keys(cfg.orderly_ssh, container)
+    with span("orderly-worker ssh"):
+        orderly_write_ssh_keys(cfg.orderly_ssh, container)
     worker_start(container)
 
 
@@ -250,35 +323,43 @@ def web_container(cfg):
     web = constellation.ConstellationContainer(
         web_name, cfg.web_ref, mounts=web_mounts, ports=web_ports,
         configure=web_configure)
-    return web
+    # The web container needs orderly to have initialised its
+    # database before the web tables can be migrated
+    return depends_on(web, cfg.containers["orderly"])
 
 
 def web_configure(container, cfg):
-    if cfg.logo_name is not None:
-        web_configure_logo(container, cfg)
+    files = ContainerFiles()
+    with span("web assets"):
+        assets_stage(container, files, web_assets(cfg))
     if cfg.sass_variables is not None:
-        web_generate_css(cfg)
-    if cfg.favicon_path is not None:
-        img = generate_favicon(cfg.favicon_path)
-        docker_util.file_into_container(img,
-                                        container,
-                                        "/static/public",
-                                        "favicon.ico")
-        os.remove(img)
-    web_container_config(container, cfg)
-    web_migrate(cfg)
+        with span("web css"):
+            web_generate_css(container, files, cfg)
+    web_container_config(files, cfg)
+    files.put(container)
+    with span("web migrate"):
+        web_migrate(container, cfg)
     web_start(container)
 
 
-def web_configure_logo(container, cfg):
-    destination_path = "/static/public/img/logo/"
-    docker_util.file_into_container(
-        cfg.logo_path, container, destination_path, cfg.logo_name)
-
+def web_generate_css(container, files, cfg):
+    image = str(cfg.images["css-generator"])
+    # The compiled css depends only on the variables and the generator
+    # image, so we store a hash of these in the css volume alongside
+    # the css and skip regenerating if they have not changed.
+    docker_util.ensure_image("css-generator", image)
+    with docker_client() as cl:
+        image_id = cl.images.get(image).id
+    with open(cfg.sass_variables, "rb") as f:
+        variables = f.read()
+    key = hashlib.sha256(image_id.encode("UTF-8") + variables).hexdigest()
+    marker = "/static/public/css/.orderly-web-css"
+    res = container.exec_run(["cat", marker])
+    if res[0] == 0 and res[1].decode("UTF-8").strip() == key:
+        print("[web] Custom css is up to date")
+        return
 
-def web_generate_css(cfg):
     print("[web] Generating custom css")
-    image = str(cfg.images["css-generator"])
     compiled_css_mount = \
         docker.types.Mount("/static/public/css", cfg.volumes["css"])
     variable_mount = \
@@ -288,16 +369,10 @@ def web_generate_css(cfg):
     mounts = [compiled_css_mount, variable_mount]
     with docker_client() as cl:
         cl.containers.run(image, mounts=mounts, remove=True)
+    files.string(marker, key)
 
 
-def generate_favicon(source):
-    img = Image.open(source)
-    fd, name = tempfile.mkstemp()
-    img.save(name, format="ico")
-    return name
-
-
-def web_container_config(container, cfg):
+def web_container_config(files, cfg):
     print("[web] Configuring web container")
     orderly_container = cfg.containers["orderly"]
     opts = {"app.port": str(cfg.web_port),
@@ -325,17 +400,77 @@ def web_container_config(container, cfg):
             "http://{}-{}:8000".format(cfg.container_prefix,
                                        outpack_container)
     txt = "".join(["{}={}\n".format(k, v) for k, v in opts.items()])
-    docker_util.exec_safely(container, ["mkdir", "-p", "/etc/orderly/web"])
-    docker_util.string_into_container(
-        txt, container, "/etc/orderly/web/config.properties")
+    files.string("/etc/orderly/web/config.properties", txt)
 
 
-def web_migrate(cfg):
-    print("[web] Migrating the web tables")
+def web_migrate(container, cfg):
     image = str(cfg.images["migrate"])
+    # We record the migrate image and the resulting schema of the
+    # orderly database in the orderly volume, and skip the migration
+    # if neither has changed since.  Rebuilding the orderly database
+    # drops the web tables, so changes the schema.
+    docker_util.ensure_image("migrate", image)
+    with docker_client() as cl:
+        image_id = cl.images.get(image).id
+    marker = web_migrate_marker(container)
+    schema = orderly_schema_hash(cfg)
+    if schema is not None and not cfg.web_force_migrate:
+        res = container.exec_run(["cat", marker])
+        expected = "{} {}".format(image_id, schema)
+        if res[0] == 0 and res[1].decode("UTF-8").strip() == expected:
+            print("[web] Web tables are up to date")
+            return
+
+    print("[web] Migrating the web tables")
     mounts = [docker.types.Mount("/orderly", cfg.volumes["orderly"])]
     with docker_client() as cl:
         cl.containers.run(image, mounts=mounts, remove=True)
+    schema = orderly_schema_hash(cfg)
+    if schema is not None:
+        files = ContainerFiles()
+        files.string(marker, "{} {}\n".format(image_id, schema))
+        files.put(container)
+    if marker != WEB_MIGRATE_MARKER_OLD:
+        container.exec_run(["rm", "-f", WEB_MIGRATE_MARKER_OLD])
+
+
+# The orderly volume is usually a git checkout of the reports, where
+# the marker would be an untracked file (which orderly may refuse to
+# switch branches with), so it goes within .git instead.  Older
+# versions wrote it to the top of the volume.
+WEB_MIGRATE_MARKER_OLD = "/orderly/.orderly-web-migrate"
+
+
+def web_migrate_marker(container):
+    if container.exec_run(["test", "-d", "/orderly/.git"])[0] == 0:
+        return "/orderly/.git/orderly-web-migrate"
+    return WEB_MIGRATE_MARKER_OLD
+
+
+# Lists every table, index, view and trigger with its definition.  The
+# web container has no sqlite client, so this is run by the orderly
+# container, which (unlike reading the database file directly) also
+# sees changes that are still in the write-ahead log.
+ORDERLY_SCHEMA_SCRIPT = """
+path <- "/orderly/orderly.sqlite"
+if (!file.exists(path)) quit(status = 1)
+con <- DBI::dbConnect(RSQLite::SQLite(), path)
+sql <- "SELECT type, name, sql FROM sqlite_master ORDER BY type, name"
+x <- DBI::dbGetQuery(con, sql)
+DBI::dbDisconnect(con)
+writeLines(paste(x$type, x$name, x$sql))
+"""
+
+
+def orderly_schema_hash(cfg):
+    """A hash of the schema of the orderly database, or None if the
+database does not exist or can't be read"""
+    container = cfg.get_container("orderly")
+    res = container.exec_run(["Rscript", "-e", ORDERLY_SCHEMA_SCRIPT],
+                             stderr=False)
+    if res[0] != 0:
+        return None
+    return hashlib.sha256(res[1]).hexdigest()
 
 
 def web_start(container):
@@ -370,20 +505,28 @@ def proxy_container(cfg, web, packit_api=None, packit=None):
     proxy = constellation.ConstellationContainer(
         proxy_name, cfg.proxy_ref, ports=proxy_ports, args=proxy_args,
         mounts=proxy_mounts, configure=proxy_configure)
-    return proxy
+    # nginx resolves its upstreams when it starts, so everything that
+    # it proxies must exist first
+    upstreams = [x.name for x in [web, packit_api, packit] if x is not None]
+    return depends_on(proxy, *upstreams)
 
 
 def proxy_configure(container, cfg):
+    with span("proxy certificates"):
+        proxy_certificates(container, cfg)
+
+
+def proxy_certificates(container, cfg):
     if cfg.proxy_ssl_self_signed:
         print("[proxy] Generating self-signed certificates for proxy")
         docker_util.exec_safely(
             container, ["self-signed-certificate", "/run/proxy"])
     else:
         print("[proxy] Copying ssl certificate and key into proxy")
-        docker_util.string_into_container(cfg.proxy_ssl_certificate, container,
-                                          "/run/proxy/certificate.pem")
-        docker_util.string_into_container(cfg.proxy_ssl_key, container,
-                                          "/run/proxy/key.pem")
+        files = ContainerFiles()
+        files.string("/run/proxy/certificate.pem", cfg.proxy_ssl_certificate)
+        files.string("/run/proxy/key.pem", cfg.proxy_ssl_key, 0o600)
+        files.put(container)
 
 
 def orderly_env(cfg, redis_container):
@@ -1,20 +1,93 @@
-import docker
-
+import io
+import os
+import tarfile
+import time
 
-def return_logs_and_remove(client, image, args=None, mounts=None):
-    try:
-        container = client.containers.run(image, args, mounts=mounts,
-                                          detach=True)
-        container.wait()
-        return container.logs().decode("UTF-8")
-    finally:
-        container.remove()
+import docker
 
 
 def read_env(container):
     return container.attrs["Config"]["Env"]
 
 
+def container_port_open(container, port):
+    # Uses bash's /dev/tcp so that we don't depend on curl or netcat
+    # being installed in the image
+    cmd = "exec 3<>/dev/tcp/localhost/{}".format(port)
+    return container.exec_run(["bash", "-c", cmd])[0] == 0
+
+
+def container_http_status(container, port, path):
+    """The status code of a GET request for 'path', made from within
+the container (in the same way as container_port_open), or None if
+there is no response"""
+    cmd = ("exec 3<>/dev/tcp/localhost/{} && "
+           "printf 'GET {} HTTP/1.0\\r\\nHost: localhost\\r\\n\\r\\n' >&3 && "
+           "read -r line <&3 && echo \"$line\"").format(port, path)
+    res = container.exec_run(["bash", "-c", cmd])
+    status = res[1].decode("UTF-8").split()
+    if res[0] != 0 or len(status) < 2 or not status[1].isdigit():
+        return None
+    return int(status[1])
+
+
+def wait_for(check, description, timeout, poll=0.1, poll_max=1):
+    """Poll 'check' until it returns True, backing off from 'poll' to
+'poll_max' seconds between attempts, and error after 'timeout' seconds"""
+    deadline = time.monotonic() + timeout
+    while not check():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise Exception("Timed out waiting for {} after {}s".format(
+                description, timeout))
+        time.sleep(min(poll, remaining))
+        poll = min(poll * 2, poll_max)
+
+
+class ContainerFiles:
+    """Collect files (and directories) to copy into a container, so that
+they can all be sent in a single archive with one docker call.  Paths
+are absolute paths within the container; missing parent directories
+are created by docker as the archive is extracted."""
+    def __init__(self):
+        self.entries = []
+
+    def directory(self, path, mode=0o755):
+        info = self._info(path, mode)
+        info.type = tarfile.DIRTYPE
+        self.entries.append((info, None))
+
+    def string(self, path, txt, mode=0o644):
+        self.bytes(path, txt.encode("UTF-8"), mode)
+
+    def bytes(self, path, data, mode=0o644):
+        info = self._info(path, mode)
+        info.size = len(data)
+        self.entries.append((info, data))
+
+    def file(self, path, local_path, mode=None):
+        if mode is None:
+            mode = os.stat(local_path).st_mode & 0o777
+        with open(local_path, "rb") as f:
+            self.bytes(path, f.read(), mode)
+
+    def put(self, container):
+        if not self.entries:
+            return
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            for info, data in self.entries:
+                tar.addfile(info, None if data is None else io.BytesIO(data))
+        container.put_archive("/", buf.getvalue())
+
+    @staticmethod
+    def _info(path, mode):
+        info = tarfile.TarInfo(path.lstrip("/"))
+        info.mode = mode
+        info.mtime = time.time()
+        return info
+
+
 # There is an annoyance with docker and the requests library, where
 # when the http handle is reclaimed a warning is printed.  It makes
 # the test log almost impossible to read.
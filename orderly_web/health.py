@@ -0,0 +1,131 @@
+import concurrent.futures
+import http.client
+import json
+import socket
+import struct
+import time
+
+from orderly_web.config import fetch_config
+from orderly_web.docker_helpers import docker_client
+from orderly_web.errors import OrderlyWebConfigError
+
+# Check that each component is actually serving, not just that its
+# container is running, by talking to it directly over the docker
+# network: an http request for the apis, PING for redis and the first
+# step of a connection for postgres.  Components without a server
+# (the workers, outpack-migrate) are not checked.
+HEALTH_TIMEOUT = 5
+
+
+def health(path, as_json=False, timeout=HEALTH_TIMEOUT):
+    cfg = fetch_config(path)
+    if not cfg:
+        msg = "OrderlyWeb not running from '{}'".format(path)
+        raise OrderlyWebConfigError(msg)
+    checks = health_checks(cfg)
+    addresses = container_addresses(cfg)
+    with concurrent.futures.ThreadPoolExecutor(len(checks)) as pool:
+        futures = {role: pool.submit(health_probe, check, port,
+                                     addresses.get(role), timeout)
+                   for role, (check, port) in checks.items()}
+        results = {role: f.result() for role, f in futures.items()}
+    if as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(health_format(results))
+    failed = [role for role, x in results.items() if not x["ok"]]
+    if failed:
+        raise Exception("Unhealthy: {}".format(", ".join(failed)))
+    return results
+
+
+def health_checks(cfg):
+    """For each component, the function to check it with and the port
+that it serves on"""
+    checks = {"redis": (check_redis, 6379),
+              "orderly": (check_http, 8321),
+              "web": (check_http, cfg.web_port)}
+    if cfg.outpack_enabled:
+        checks["outpack-server"] = (check_http, 8000)
+    if cfg.packit_enabled:
+        checks["packit-db"] = (check_postgres, 5432)
+        checks["packit-api"] = (check_http, 8080)
+        checks["packit"] = (check_http, 80)
+    if cfg.proxy_enabled:
+        checks["proxy"] = (check_http, cfg.proxy_port_http)
+    return checks
+
+
+def container_addresses(cfg):
+    """The address of each component's container on the network, from a
+single docker call"""
+    roles = {"{}-{}".format(cfg.container_prefix, name): role
+             for role, name in cfg.containers.items()}
+    ret = {}
+    with docker_client() as cl:
+        found = cl.api.containers(filters={"network": cfg.network})
+    for x in found:
+        role = roles.get(x["Names"][0].lstrip("/"))
+        networks = x["NetworkSettings"]["Networks"]
+        if role is not None and cfg.network in networks:
+            ret[role] = networks[cfg.network]["IPAddress"]
+    return ret
+
+
+def health_probe(check, port, address, timeout):
+    if not address:
+        return {"ok": False, "latency": None, "detail": "not running"}
+    t0 = time.monotonic()
+    try:
+        detail = check(address, port, timeout)
+        ok = True
+    except socket.timeout:
+        ok, detail = False, "timed out after {}s".format(timeout)
+    except Exception as e:
+        ok, detail = False, str(e) or type(e).__name__
+    latency = round((time.monotonic() - t0) * 1000, 1)
+    return {"ok": ok, "latency": latency, "detail": detail}
+
+
+def check_http(address, port, timeout):
+    con = http.client.HTTPConnection(address, port, timeout=timeout)
+    try:
+        con.request("GET", "/")
+        status = con.getresponse().status
+    finally:
+        con.close()
+    # Anything short of a server error shows that the server is up
+    # and handling requests (e.g., a redirect to log in)
+    if status >= 500:
+        raise Exception("HTTP {}".format(status))
+    return "HTTP {}".format(status)
+
+
+def check_redis(address, port, timeout):
+    with socket.create_connection((address, port), timeout) as s:
+        s.sendall(b"PING\r\n")
+        reply = s.recv(64)
+    if not reply.startswith(b"+PONG"):
+        raise Exception("Unexpected reply {!r}".format(reply))
+    return "PONG"
+
+
+def check_postgres(address, port, timeout):
+    # An SSLRequest message gets a single byte reply, 'S' or 'N', from
+    # a server that is accepting connections, without needing to log in
+    with socket.create_connection((address, port), timeout) as s:
+        s.sendall(struct.pack("!ii", 8, 80877103))
+        reply = s.recv(1)
+    if reply not in (b"S", b"N"):
+        raise Exception("Unexpected reply {!r}".format(reply))
+    return "accepting connections"
+
+
+def health_format(results):
+    lines = []
+    for role, x in results.items():
+        latency = "-" if x["latency"] is None else \
+            "{:.1f}ms".format(x["latency"])
+        lines.append("{:<16}{:<8}{:>10}  {}".format(
+            role, "ok" if x["ok"] else "FAILED", latency, x["detail"]))
+    return "\n".join(lines)
@@ -1,11 +1,92 @@
+import concurrent.futures
+import threading
+
 from orderly_web.docker_helpers import docker_client
 
+# Most of our images are large and share base layers, so we pull a few
+# at a time and let the docker daemon deduplicate the shared layers.
+MAX_PULLS = 4
+
+# Layer statuses from the docker pull stream that are worth reporting;
+# everything else ("Downloading", "Extracting", etc) is just progress
+# within a layer and would flood the terminal.
+LAYER_STATUSES = ["Already exists", "Download complete", "Pull complete"]
 
-def pull(images):
+
+def pull(images, max_workers=MAX_PULLS):
     print("Pulling images:")
+    # Several roles can share the same image (e.g., orderly and
+    # orderly-worker) so we pull each reference only once
+    refs = {}
+    for name, ref in images.items():
+        refs.setdefault(str(ref), (name, ref))
+    progress = PullProgress()
     with docker_client() as cl:
-        for name, repo in images.items():
-            image = str(repo)
-            print("  - {} ({})".format(name, image))
-            img = cl.images.pull(str(image))
-            print("    `-> {}".format(img.short_id))
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+            futures = [pool.submit(pull_image, cl, name, ref, progress)
+                       for name, ref in refs.values()]
+        for f in futures:
+            f.result()
+    progress.summary()
+
+
+def pull_image(cl, name, ref, progress):
+    image = str(ref)
+    progress.message("  - {} ({})".format(name, image))
+    repository = "{}/{}".format(ref.repo, ref.name)
+    stream = cl.api.pull(repository, tag=ref.tag, stream=True, decode=True)
+    for event in stream:
+        if "error" in event:
+            raise Exception("Error pulling {}: {}".format(
+                image, event["error"]))
+        progress.update(name, event)
+    img = cl.images.get(image)
+    progress.message("    `-> {} ({})".format(img.short_id, name))
+    return img
+
+
+class PullProgress:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.downloaded = set()
+        self.reused = set()
+
+    def message(self, msg):
+        with self.lock:
+            print(msg, flush=True)
+
+    def update(self, name, event):
+        layer = event.get("id")
+        status = event.get("status")
+        if not layer or status is None:
+            return
+        with self.lock:
+            total = event.get("progressDetail", {}).get("total")
+            if status == "Downloading" and total:
+                self.sizes[layer] = total
+            if status not in LAYER_STATUSES:
+                return
+            if status == "Already exists":
+                self.reused.add(layer)
+            elif status == "Pull complete":
+                self.downloaded.add(layer)
+            print("    [{}] {}: {}".format(name, layer, status), flush=True)
+
+    def bytes_downloaded(self):
+        return sum(self.sizes.get(x, 0) for x in self.downloaded)
+
+    def summary(self):
+        # The registry does not tell us the size of layers that we
+        # already have, so these are reported by count only
+        print("Downloaded {} in {} layers; reused {} existing layers".format(
+            format_bytes(self.bytes_downloaded()), len(self.downloaded),
+            len(self.reused - self.downloaded)))
+
+
+def format_bytes(n):
+    for unit in ["B", "KB", "MB"]:
+        if n < 1024:
+            return "{:.1f} {}".format(n, unit)
+        n /= 1024
+    return "{:.1f} GB".format(n)
@@ -0,0 +1,49 @@
+import constellation.docker_util as docker_util
+
+from orderly_web.config import fetch_config
+from orderly_web.constellation import orderly_constellation
+from orderly_web.errors import OrderlyWebConfigError
+from orderly_web.schedule import MAX_REPLICA_WORKERS, run_graph, \
+    start_replicas
+from orderly_web.start import config_save
+
+# Seconds that docker waits for a worker to exit after asking it to
+# stop, before killing it
+WORKER_STOP_TIMEOUT = 60
+
+
+def scale(path, workers):
+    """Change the number of orderly workers of a running deployment,
+without touching any other container"""
+    if workers < 0:
+        raise Exception("Number of workers must be non-negative")
+    cfg = fetch_config(path)
+    if not cfg:
+        msg = "OrderlyWeb not running from '{}'".format(path)
+        raise OrderlyWebConfigError(msg)
+    obj = orderly_constellation(cfg)
+    service = obj.containers.find(cfg.containers["orderly-worker"])
+    current = service.get(obj.prefix)
+    print("Scaling workers from {} to {}".format(len(current), workers))
+    if workers > len(current):
+        start_replicas(service, workers - len(current), obj.prefix,
+                       obj.network, obj.volumes, cfg)
+    elif workers < len(current):
+        # Remove the most recently created workers first
+        current.sort(key=lambda x: x.attrs["Created"], reverse=True)
+        workers_remove(current[:len(current) - workers], service.name)
+    cfg.workers = workers
+    config_save(cfg)
+
+
+def workers_remove(containers, name):
+    def remove_task(container):
+        def remove():
+            print("[{}] Stopping {}".format(name, container.name))
+            with docker_util.ignoring_missing():
+                container.stop(timeout=WORKER_STOP_TIMEOUT)
+                container.remove()
+        return remove
+
+    tasks = {x.name: remove_task(x) for x in containers}
+    run_graph(tasks, {}, MAX_REPLICA_WORKERS)
@@ -0,0 +1,153 @@
+import concurrent.futures
+import time
+
+import constellation
+from constellation.util import rand_str
+
+from orderly_web.timing import span
+from orderly_web.vault import vault_resolve
+
+# The constellation package starts containers one after another, in
+# the order that they were given.  Most of our containers depend on
+# only one or two of the others though (e.g., orderly needs redis,
+# packit-api needs packit-db) so instead we start each container as
+# soon as everything it depends on is up and configured, running
+# independent branches side-by-side on a bounded pool of threads.
+MAX_WORKERS = 4
+# Replicas of a service are independent of each other, and
+# configuring each is mostly spent waiting on docker exec calls, so we
+# allow more of these to run at once.
+MAX_REPLICA_WORKERS = 16
+
+
+def depends_on(container, *names):
+    """Declare that a container can only be started once the
+containers with the given names have been started and configured"""
+    container.depends_on = list(names)
+    return container
+
+
+def dependencies(containers):
+    return {x.name: getattr(x, "depends_on", []) for x in containers}
+
+
+def run_graph(tasks, deps, max_workers=MAX_WORKERS):
+    """Run a dictionary of zero-argument callables, each one starting
+once all the tasks named in its entry in 'deps' have completed.
+Dependencies that are not themselves tasks are assumed to be
+satisfied already.  If any task fails then no further tasks are
+started and the first error is raised once running tasks finish."""
+    waiting = {name: set(d for d in deps.get(name, []) if d in tasks)
+               for name in tasks}
+    done = set()
+    running = {}
+    error = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        def submit_ready():
+            for name in list(waiting.keys()):
+                if waiting[name].issubset(done):
+                    del waiting[name]
+                    running[pool.submit(tasks[name])] = name
+
+        submit_ready()
+        while running:
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in finished:
+                name = running.pop(f)
+                if f.exception() is None:
+                    done.add(name)
+                elif error is None:
+                    error = f.exception()
+            if error is None:
+                submit_ready()
+    if error is not None:
+        raise error
+    if waiting:
+        msg = "Could not resolve dependencies for: {}".format(
+            ", ".join(sorted(waiting.keys())))
+        raise Exception(msg)
+    return done
+
+
+def start_constellation(obj, pull_images=False, subset=None,
+                        max_workers=MAX_WORKERS):
+    """Equivalent to obj.start() for a constellation.Constellation
+object, but starting containers according to their dependencies.  If
+'subset' is given, only the containers with these names are started
+and the others are assumed to be running already."""
+    if subset is None and any(obj.containers.exists(obj.prefix)):
+        raise Exception("Some containers exist")
+    if obj.vault_config:
+        vault_resolve(obj.data, obj.vault_config)
+    if pull_images:
+        obj.containers.pull_images()
+    obj.network.create()
+    obj.volumes.create()
+    containers = obj.containers.collection
+    tasks = {x.name: start_task(x, obj) for x in containers
+             if subset is None or x.name in subset}
+    run_graph(tasks, dependencies(containers), max_workers)
+
+
+def stop_containers(obj, subset, kill=False, max_workers=MAX_WORKERS):
+    """Stop and remove the named containers of a constellation, each
+only after everything that depends on it has been stopped"""
+    containers = obj.containers.collection
+    tasks = {x.name: stop_task(x, obj, kill) for x in containers
+             if x.name in subset}
+    run_graph(tasks, dependents(containers), max_workers)
+
+
+def dependents(containers):
+    """The reverse of dependencies(): the names of the containers that
+depend on each container"""
+    ret = {x.name: [] for x in containers}
+    for name, deps in dependencies(containers).items():
+        for d in deps:
+            if d in ret:
+                ret[d].append(name)
+    return ret
+
+
+def stop_task(container, obj, kill):
+    def stop():
+        container.stop(obj.prefix, kill)
+        container.remove(obj.prefix)
+    return stop
+
+
+def start_task(container, obj):
+    def start():
+        if isinstance(container, constellation.ConstellationService):
+            start_replicas(container, container.scale, obj.prefix,
+                           obj.network, obj.volumes, obj.data)
+        else:
+            with span("start {}".format(container.name)):
+                container.start(obj.prefix, obj.network, obj.volumes,
+                                obj.data)
+    return start
+
+
+def start_replicas(service, n, prefix, network, volumes, data=None,
+                   max_workers=MAX_REPLICA_WORKERS):
+    """Start (and configure) 'n' new replicas of a
+constellation.ConstellationService concurrently, rather than one after
+another as service.start() does"""
+    print("Starting *service* {} ({} replicas)".format(service.name, n))
+    replicas = [constellation.ConstellationContainer(
+        "{}-{}".format(service.name, rand_str(8)), service.image,
+        **service.kwargs) for _ in range(n)]
+
+    def replica_task(replica):
+        def start():
+            t0 = time.monotonic()
+            with span("start {}".format(service.name)):
+                replica.start(prefix, network, volumes, data)
+            print("[{}] Started {} in {:.1f}s".format(
+                service.name, replica.name, time.monotonic() - t0))
+        return start
+
+    tasks = {x.name: replica_task(x) for x in replicas}
+    run_graph(tasks, {}, max_workers)
+    return [x.name for x in replicas]
@@ -3,27 +3,49 @@ from constellation.notifier import Notifier
 from orderly_web.config import build_config
 from orderly_web.constellation import orderly_constellation
 from orderly_web.pull import pull
+from orderly_web.schedule import start_constellation
+from orderly_web.timing import span, timing_format, timing_message, \
+    timing_reset, timing_spans, trace_write
 
 
-def start(path, extra=None, options=None, pull_images=False):
+def start(path, extra=None, options=None, pull_images=False,
+          force_migrate=False, trace=None):
+    timing_reset()
     cfg = build_config(path, extra, options)
-    cfg.resolve_secrets()
+    cfg.web_force_migrate = force_migrate
+    cfg.record_files()
+    with span("vault"):
+        cfg.resolve_secrets()
     obj = orderly_constellation(cfg)
     if pull_images:
-        # Manually pull images which are not part of the constellation
-        pull(cfg.non_constellation_images)
+        # Pull everything (including images that are not part of the
+        # constellation) together, rather than letting constellation
+        # pull its images one at a time
+        with span("pull"):
+            pull(cfg.images)
 
     notifier = Notifier(cfg.slack_webhook_url)
     notifier.post("*Starting* deploy to {}".format(cfg.web_url))
     try:
-        obj.start(pull_images=pull_images)
-        notifier.post("*Completed* deploy to {} :shipit:"
-                      .format(cfg.web_url))
+        start_constellation(obj)
+        spans = timing_spans()
+        notifier.post("*Completed* deploy to {} :shipit: {}"
+                      .format(cfg.web_url, timing_message(spans)))
         config_save(cfg)
         return True
     except Exception:
         notifier.post("*Failed* deploy to {} :bomb:".format(cfg.web_url))
         raise
+    finally:
+        timing_report(trace)
+
+
+def timing_report(trace=None):
+    spans = timing_spans()
+    print(timing_format(spans))
+    if trace:
+        trace_write(spans, trace)
+        print("Wrote trace to '{}'".format(trace))
 
 
 def config_save(cfg):
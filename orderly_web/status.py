@@ -1,23 +1,216 @@
+import concurrent.futures
+import datetime
+import json
+
 import docker
 
 from orderly_web.config import fetch_config, build_config
-from orderly_web.constellation import orderly_constellation
+from orderly_web.docker_helpers import docker_client
 from orderly_web.errors import OrderlyWebConfigError
 
+# Components that run as a set of replicas, named <prefix>-<name>-<id>
+SERVICES = ["orderly-worker"]
+MAX_INSPECT = 8
+# Container state transitions reported by 'status --watch'
+WATCH_EVENTS = ["start", "stop", "die", "oom", "restart", "health_status"]
+
 
-def status(path):
+def status(path, as_json=False, watch=False):
+    """Report the state of the network, volumes and containers.  This
+lists all containers with a single docker call, rather than inspecting
+each one; with 'as_json' the containers are also inspected (all at
+once) for their uptime and restart count, and the images listed for
+their registry digests.  With 'watch', instead
+report changes in container state as they happen."""
     try:
         cfg = fetch_config(path)
     except docker.errors.NotFound as e:
         cfg = build_config(path)
-    if cfg:
-        try:
-            obj = orderly_constellation(cfg)
-            obj.status()
-        except AttributeError as e:
-            msg = ("Unable to manage constellation from existing config."
-                   " The format of the config may have changed. You should"
-                   " force a stop and restart.")
-            raise OrderlyWebConfigError(msg) from e
+    if watch:
+        status_watch(cfg or build_config(path), as_json)
+        return
+    if not cfg:
+        if as_json:
+            print(json.dumps({"running": False}))
+        else:
+            print("OrderlyWeb not running from '{}'".format(path))
+        return
+    try:
+        dat = status_data(cfg, as_json)
+    except AttributeError as e:
+        msg = ("Unable to manage constellation from existing config."
+               " The format of the config may have changed. You should"
+               " force a stop and restart.")
+        raise OrderlyWebConfigError(msg) from e
+    if as_json:
+        print(json.dumps(dat, indent=2))
     else:
-        print("OrderlyWeb not running from '{}'".format(path))
+        print(status_format(dat))
+    return dat
+
+
+def status_data(cfg, detail=False):
+    prefix = cfg.container_prefix
+    with docker_client() as cl:
+        found = [x for x in cl.api.containers(all=True,
+                                              filters={"name": prefix})
+                 if x["Names"][0].lstrip("/").startswith(prefix + "-")]
+        network = bool(cl.api.networks(names=[cfg.network]))
+        volumes = set(x["Name"] for x in cl.api.volumes()["Volumes"] or [])
+        if detail:
+            with concurrent.futures.ThreadPoolExecutor(MAX_INSPECT) as pool:
+                info = list(pool.map(lambda x: cl.api.inspect_container(
+                    x["Id"]), found))
+            digests = {x["Id"]: x.get("RepoDigests") or []
+                       for x in cl.api.images()}
+        else:
+            info = [None] * len(found)
+            digests = {}
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    containers = {x["Names"][0].lstrip("/"):
+                  container_data(x, i, now, digests.get(x["ImageID"], []))
+                  for x, i in zip(found, info)}
+    components = {}
+    for role, name in cfg.containers.items():
+        external = "{}-{}".format(prefix, name)
+        match = sorted(x for x in containers
+                       if container_role(cfg, x) == role)
+        components[role] = {"name": name, "external": external,
+                            "service": role in SERVICES,
+                            "containers": [containers[x] for x in match]}
+    return {"running": True,
+            "prefix": prefix,
+            "network": {"name": cfg.network, "exists": network},
+            "volumes": {role: {"name": name, "exists": name in volumes}
+                        for role, name in cfg.volumes.items()},
+            "components": components}
+
+
+def container_role(cfg, name):
+    """The component that a container belongs to, or None"""
+    for role, x in cfg.containers.items():
+        external = "{}-{}".format(cfg.container_prefix, x)
+        if name == external and role not in SERVICES or \
+                name.startswith(external + "-") and role in SERVICES:
+            return role
+    return None
+
+
+def status_watch(cfg, as_json=False):
+    """Print container state changes as they happen, until interrupted.
+Docker streams the events to us, so there is no polling, and docker
+can only filter events by exact container name so we filter by
+prefix here."""
+    if not as_json:
+        print("Watching containers of '{}' (Ctrl-C to stop)".format(
+            cfg.container_prefix), flush=True)
+    filters = {"type": "container", "event": WATCH_EVENTS}
+    with docker_client() as cl:
+        events = cl.events(decode=True, filters=filters)
+        try:
+            for x in events:
+                line = event_format(cfg, x, as_json)
+                if line is not None:
+                    print(line, flush=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            events.close()
+
+
+def event_format(cfg, event, as_json=False):
+    attributes = dict(event.get("Actor", {}).get("Attributes", {}))
+    name = attributes.pop("name", "")
+    role = container_role(cfg, name)
+    if role is None:
+        return None
+    # health_status events have the new status in the action, e.g.,
+    # 'health_status: healthy'
+    action = event.get("Action") or event.get("status", "")
+    action, _, detail = action.partition(":")
+    time = datetime.datetime.fromtimestamp(
+        event["time"], datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    detail = detail.strip() or None
+    if as_json:
+        return json.dumps({"time": time, "component": role,
+                           "container": name, "event": action,
+                           "detail": detail,
+                           "exit_code": attributes.get("exitCode")})
+    ret = "{} {} ({}): {}".format(time, role, name, action)
+    if detail:
+        ret += " ({})".format(detail)
+    if "exitCode" in attributes:
+        ret += " (exit code {})".format(attributes["exitCode"])
+    return ret
+
+
+def container_data(x, info, now, digests):
+    ret = {"name": x["Names"][0].lstrip("/"),
+           "state": x["State"],
+           "image": x["Image"],
+           "image_id": x["ImageID"]}
+    if info is not None:
+        started = parse_time(info["State"]["StartedAt"])
+        running = info["State"]["Running"] and started is not None
+        ret["started_at"] = info["State"]["StartedAt"]
+        ret["uptime"] = (now - started).total_seconds() if running else None
+        ret["restart_count"] = info["RestartCount"]
+        ret["image_digest"] = image_digest(x["Image"], digests)
+    return ret
+
+
+def image_digest(image, digests):
+    """The registry digest (repo@sha256:...) of the image that the
+container was started from, or None for an image that was built
+locally rather than pulled.  'image_id' is only the local id, which
+differs between machines for the same image."""
+    # A tag follows the last ':', unless that is part of a registry
+    # host:port
+    repo, _, tag = image.rpartition(":")
+    if not repo or "/" in tag:
+        repo = image
+    for x in digests:
+        if x.split("@")[0] == repo:
+            return x
+    return digests[0] if digests else None
+
+
+def parse_time(x):
+    # docker gives times with nanoseconds, which datetime can't parse
+    try:
+        ret = datetime.datetime.strptime(x[:19], "%Y-%m-%dT%H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+    if ret.year < 2000:
+        # Containers that have never started have a zero time
+        return None
+    return ret.replace(tzinfo=datetime.timezone.utc)
+
+
+def status_format(dat):
+    """Format status in the same way as constellation does"""
+    def created(exists):
+        return "created" if exists else "missing"
+
+    lines = ["Constellation orderly-web",
+             "  * Network:",
+             "    - {}: {}".format(dat["network"]["name"],
+                                   created(dat["network"]["exists"])),
+             "  * Volumes:"]
+    for role, v in dat["volumes"].items():
+        lines.append("    - {} ({}): {}".format(
+            role, v["name"], created(v["exists"])))
+    lines.append("  * Containers:")
+    for x in dat["components"].values():
+        states = [y["state"] for y in x["containers"]]
+        if x["service"]:
+            counts = {s: states.count(s) for s in sorted(set(states))}
+            state = ", ".join("{} ({})".format(k, v)
+                              for k, v in counts.items()) or "missing"
+            external = x["external"] + "-<i>"
+        else:
+            state = states[0] if states else "missing"
+            external = x["external"]
+        lines.append("    - {} ({}): {}".format(x["name"], external, state))
+    return "\n".join(lines)
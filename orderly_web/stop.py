@@ -9,7 +9,7 @@ def stop(path, kill=False, network=False, volumes=False, force=False,
          extra=None, options=None):
     try:
         cfg = fetch_config(path)
-    except docker.errors.NotFound as e:
+    except (docker.errors.NotFound, OrderlyWebConfigError) as e:
         if force:
             print("Unable to fetch config from orderly-web, forcing stop.")
             cfg = build_config(path, extra, options)
@@ -0,0 +1,158 @@
+import json
+
+import constellation.docker_util as docker_util
+
+from orderly_web.admin import apply_operations, check_results
+from orderly_web.config import fetch_config
+
+# Bring users, groups, membership and permissions into line with a
+# desired state, by reading the current state from the OrderlyWeb
+# tables of the orderly database and applying only the difference.
+# The admin cli can add but not remove, so anything present that is
+# not in the desired state is reported but left alone.
+#
+# The desired state is a yml (or json) file like:
+#
+#   users:
+#     - a@example.com
+#   groups:
+#     funders:
+#       members: [a@example.com]
+#       permissions: ["*/reports.read", "report:minimal/reports.run"]
+#
+# Each user has a group of their own, named by their email, so
+# permissions for individual users are given under "groups" too; a
+# group named by an email is created by adding that user.
+ORDERLY_DB = "/orderly/orderly.sqlite"
+# The current state is read by running these queries in the orderly
+# container, which has R and the packages that orderly uses to read
+# its database, rather than copying the whole database out.  Global
+# permissions are given as '*/<permission>' and report permissions as
+# 'report:<name>/<permission>', as for the admin cli's grant command.
+STATE_QUERIES = {
+    "users": "SELECT email FROM orderlyweb_user",
+    "groups": "SELECT id FROM orderlyweb_user_group",
+    "members": "SELECT user_group, email FROM orderlyweb_user_group_user",
+    "global": ("SELECT p.user_group, p.permission"
+               "  FROM orderlyweb_user_group_permission p"
+               "  JOIN orderlyweb_user_group_global_permission g"
+               "    ON g.id = p.id"),
+    "report": ("SELECT p.user_group, p.permission, r.report"
+               "  FROM orderlyweb_user_group_permission p"
+               "  JOIN orderlyweb_user_group_report_permission r"
+               "    ON r.id = p.id")
+}
+
+
+def sync_permissions(path, filename, dry_run=False):
+    """Apply the changes needed to bring users, groups, members and
+permissions in line with a yml (or json) file"""
+    import yaml
+    with open(filename) as f:
+        desired = desired_state(yaml.safe_load(f) or {})
+    cfg = fetch_config(path)
+    if not cfg:
+        raise Exception("OrderlyWeb not running from '{}'".format(path))
+    current = read_current(cfg)
+    operations, extra = state_delta(current, desired)
+    for x in extra:
+        print("Not removing {} (not supported by the admin cli)".format(x))
+    if not operations:
+        print("Users and permissions are up to date")
+        return []
+    if dry_run:
+        for x in operations:
+            print("Would apply {}".format(x))
+        return operations
+    return check_results(apply_operations(path, operations))
+
+
+def desired_state(dat):
+    groups = {}
+    for name, group in (dat.get("groups") or {}).items():
+        group = group or {}
+        groups[name] = {
+            "members": set(group.get("members") or []),
+            "permissions": set(group.get("permissions") or [])}
+    return {"users": set(dat.get("users") or []), "groups": groups}
+
+
+def read_current(cfg):
+    container = cfg.get_container("orderly")
+    res = docker_util.exec_safely(container, ["Rscript", "-e", state_script()],
+                                  stderr=False)
+    return state_from_rows(json.loads(res[1].decode("UTF-8")))
+
+
+def state_script():
+    # json strings are also valid R strings
+    queries = ", ".join("{} = q({})".format(k, json.dumps(v))
+                        for k, v in STATE_QUERIES.items())
+    return ("con <- DBI::dbConnect(RSQLite::SQLite(), {})\n"
+            "q <- function(sql) DBI::dbGetQuery(con, sql)\n"
+            "res <- list({})\n"
+            "DBI::dbDisconnect(con)\n"
+            "cat(jsonlite::toJSON(res, dataframe = \"values\"))\n").format(
+                json.dumps(ORDERLY_DB), queries)
+
+
+def state_from_rows(rows):
+    """Users, groups, members and permissions from the results of
+STATE_QUERIES, each a list of rows"""
+    users = {x[0] for x in rows["users"]}
+    groups = {x[0]: {"members": set(), "permissions": set()}
+              for x in rows["groups"]}
+    for group, email in rows["members"]:
+        groups[group]["members"].add(email)
+    for group, permission in rows["global"]:
+        groups[group]["permissions"].add("*/" + permission)
+    for group, permission, report in rows["report"]:
+        groups[group]["permissions"].add(
+            "report:{}/{}".format(report, permission))
+    return {"users": users, "groups": groups}
+
+
+def state_delta(current, desired):
+    """The admin operations needed to get from the current state to
+the desired one, and a list of things that would need removing"""
+    members = set()
+    for name, group in desired["groups"].items():
+        members |= group["members"]
+        if "@" in name:
+            members.add(name)
+    users = sorted((desired["users"] | members) - current["users"])
+    operations = []
+    if users:
+        operations.append({"add-users": users})
+    # Adding a user creates their own group too
+    known = set(current["groups"]) | set(users)
+    groups = sorted(set(desired["groups"]) - known)
+    if groups:
+        operations.append({"add-groups": groups})
+    for name in sorted(desired["groups"]):
+        want = desired["groups"][name]
+        have = current["groups"].get(name, {})
+        add = sorted(want["members"] - have.get("members", set()))
+        if add:
+            operations.append(
+                {"add-members": {"group": name, "emails": add}})
+        add = sorted(want["permissions"] - have.get("permissions", set()))
+        if add:
+            operations.append(
+                {"grant": {"group": name, "permissions": add}})
+
+    extra = ["user {}".format(x)
+             for x in sorted(current["users"] - desired["users"] - members)]
+    extra += ["group {}".format(x) for x in sorted(current["groups"])
+              if x not in desired["groups"] and x not in current["users"]]
+    for name in sorted(desired["groups"]):
+        want = desired["groups"][name]
+        have = current["groups"].get(name, {})
+        # A user is always a member of their own group
+        extra += ["member {} of {}".format(x, name)
+                  for x in sorted(have.get("members", set()) -
+                                  want["members"] - {name})]
+        extra += ["permission {} of {}".format(x, name)
+                  for x in sorted(have.get("permissions", set()) -
+                                  want["permissions"])]
+    return operations, extra
@@ -0,0 +1,105 @@
+import contextlib
+import json
+import threading
+import time
+
+# Timings of the phases of a deploy.  Phases run on many threads at
+# once (see schedule.py) and the configure hooks are called by
+# constellation with only the container and configuration, so spans
+# are collected here rather than passed around.  Call timing_reset()
+# at the start of each deploy.
+TIMING_LOCK = threading.Lock()
+TIMING = {"t0": time.monotonic(), "spans": []}
+TIMING_STACK = threading.local()
+
+
+def timing_reset():
+    with TIMING_LOCK:
+        TIMING["t0"] = time.monotonic()
+        TIMING["spans"] = []
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time the body of a 'with' block as the phase 'name'.  A span
+with other spans within it on the same thread is not a 'leaf', and is
+not considered when reporting the slowest phases"""
+    stack = TIMING_STACK.__dict__.setdefault("stack", [])
+    if stack:
+        stack[-1]["leaf"] = False
+    x = {"name": name, "thread": threading.get_ident(), "leaf": True,
+         "start": time.monotonic()}
+    stack.append(x)
+    try:
+        yield
+    finally:
+        stack.pop()
+        x["duration"] = time.monotonic() - x["start"]
+        with TIMING_LOCK:
+            TIMING["spans"].append(x)
+
+
+def timing_spans():
+    """Completed spans in order of starting, with start times relative
+to the last reset"""
+    with TIMING_LOCK:
+        t0 = TIMING["t0"]
+        spans = [dict(x) for x in TIMING["spans"]]
+    for x in spans:
+        x["start"] -= t0
+    return sorted(spans, key=lambda x: x["start"])
+
+
+def timing_total(spans):
+    return max((x["start"] + x["duration"] for x in spans), default=0)
+
+
+def timing_summary(spans, leaf_only=False):
+    """Total time and count of each phase, in order of first starting"""
+    ret = {}
+    for x in spans:
+        if leaf_only and not x["leaf"]:
+            continue
+        y = ret.setdefault(x["name"], {"count": 0, "total": 0})
+        y["count"] += 1
+        y["total"] += x["duration"]
+    return ret
+
+
+def timing_slowest(spans, n=3):
+    summary = timing_summary(spans, leaf_only=True)
+    names = sorted(summary, key=lambda x: summary[x]["total"], reverse=True)
+    return [(x, summary[x]["total"]) for x in names[:n]]
+
+
+def timing_format(spans):
+    lines = ["Timings:"]
+    for name, x in timing_summary(spans).items():
+        count = " (x{})".format(x["count"]) if x["count"] > 1 else ""
+        lines.append("  {:<28}{:>8.1f}s{}".format(name, x["total"], count))
+    lines.append("  {:<28}{:>8.1f}s".format("total", timing_total(spans)))
+    return "\n".join(lines)
+
+
+def timing_message(spans):
+    """Short description of the deploy time for the slack message"""
+    slowest = ", ".join("{} {:.1f}s".format(name, t)
+                        for name, t in timing_slowest(spans))
+    ret = "in {:.1f}s".format(timing_total(spans))
+    if slowest:
+        ret += " (slowest: {})".format(slowest)
+    return ret
+
+
+def trace_write(spans, filename):
+    """Write spans in Chrome's trace event format, which can be viewed
+in chrome://tracing or https://ui.perfetto.dev"""
+    threads = {}
+    events = []
+    for x in spans:
+        tid = threads.setdefault(x["thread"], len(threads) + 1)
+        events.append({"name": x["name"], "ph": "X", "pid": 1, "tid": tid,
+                       "ts": round(x["start"] * 1e6),
+                       "dur": round(x["duration"] * 1e6)})
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
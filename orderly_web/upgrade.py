@@ -0,0 +1,226 @@
+import json
+
+import constellation
+import docker
+from constellation.notifier import Notifier
+
+from orderly_web.blue_green import blue_green_check, web_blue_green
+from orderly_web.config import build_config, config_encode_value, \
+    fetch_config
+from orderly_web.constellation import orderly_constellation
+from orderly_web.docker_helpers import docker_client
+from orderly_web.errors import OrderlyWebConfigError
+from orderly_web.pull import pull
+from orderly_web.schedule import dependents, start_constellation, \
+    stop_containers
+from orderly_web.start import config_save
+
+# Configuration that is used by a container's configure hook, after
+# it has been created, and so does not appear in its container spec.
+# Keyed by the container's role (the names used in cfg.containers).
+CONFIGURE_FIELDS = {
+    "orderly": ["orderly_ssh"],
+    "orderly-worker": ["orderly_ssh"],
+    "web": ["web_name", "web_email", "web_url", "web_port",
+            "web_auth_github_org", "web_auth_github_team",
+            "web_auth_fine_grained", "web_auth_montagu",
+            "web_auth_github_app", "montagu_url", "montagu_api_url",
+            "logo_name", "logo_path", "favicon_path", "sass_variables",
+            "web_file_hashes", "outpack_enabled", "css_generator_ref",
+            "migrate_ref"],
+    "proxy": ["proxy_ssl_self_signed", "proxy_ssl_certificate",
+              "proxy_ssl_key"]
+}
+
+
+def upgrade(path, extra=None, options=None, pull_images=False,
+            components=None, blue_green=False):
+    """Bring a running deployment up to date with its configuration,
+recreating only the containers whose configuration has changed, along
+with the containers that depend on them.  Any 'components' given are
+recreated even if unchanged, and then nothing else may have changed.
+With 'blue_green', the web container is replaced without downtime
+rather than recreated."""
+    old = fetch_config(path)
+    if not old:
+        msg = "OrderlyWeb not running from '{}'".format(path)
+        raise OrderlyWebConfigError(msg)
+    cfg = build_config(path, extra, options)
+    cfg.record_files()
+    cfg.resolve_secrets()
+    upgrade_workers(old, cfg)
+    if old.container_prefix != cfg.container_prefix or \
+            old.network != cfg.network:
+        msg = ("The container prefix or network has changed, which needs"
+               " a full stop and start")
+        raise OrderlyWebConfigError(msg)
+    old_obj = orderly_constellation(old)
+    obj = orderly_constellation(cfg)
+
+    # Pull first, so that new images for the same tags (e.g., master)
+    # are seen as changes
+    if pull_images:
+        pull(cfg.images)
+    changed = upgrade_changes(old, old_obj, cfg, obj) | image_changes(obj)
+    forced = component_names(components or [], cfg, old_obj, obj)
+    recreate = upgrade_plan(changed, forced, old_obj, obj)
+    web = cfg.containers["web"]
+    swap = blue_green and web in recreate
+    if swap:
+        blue_green_check(cfg)
+        recreate = upgrade_plan(changed - {web}, forced - {web},
+                                old_obj, obj)
+        if web in recreate or cfg.containers["proxy"] in recreate:
+            msg = ("Blue/green upgrade of {} is only possible if neither"
+                   " the containers it depends on nor the proxy have"
+                   " changed").format(web)
+            raise OrderlyWebConfigError(msg)
+    if not recreate and not swap:
+        print("Nothing to upgrade")
+        return []
+    recreate = sorted(recreate)
+    upgraded = sorted(recreate + [web]) if swap else recreate
+    print("Upgrading {}".format(", ".join(upgraded)))
+
+    notifier = Notifier(cfg.slack_webhook_url)
+    notifier.post("*Upgrading* {} on {}".format(
+        ", ".join(upgraded), cfg.web_url))
+    try:
+        if recreate:
+            stop_containers(old_obj, recreate)
+            start_constellation(obj, subset=recreate)
+        if swap:
+            web_blue_green(obj, cfg)
+        notifier.post("*Completed* upgrade of {} :shipit:".format(
+            cfg.web_url))
+        config_save(cfg)
+        return upgraded
+    except Exception:
+        notifier.post("*Failed* upgrade of {} :bomb:".format(cfg.web_url))
+        raise
+
+
+def upgrade_workers(old, cfg):
+    """Keep the number of workers set by 'scale', unless the configured
+number has changed since the last start or upgrade"""
+    # Configuration saved before workers_configured existed
+    configured = getattr(old, "workers_configured", old.workers)
+    if old.workers == configured:
+        return
+    if cfg.workers == configured:
+        print("Keeping {} workers, as set by scale".format(old.workers))
+        cfg.workers = old.workers
+    else:
+        print("Changing from {} workers, as set by scale, to {} as"
+              " configured".format(old.workers, cfg.workers))
+
+
+def upgrade_changes(old, old_obj, cfg, obj):
+    """The names of containers that have been added, removed, or have
+a different specification or configuration"""
+    # Configuration saved before the hashes of files were recorded
+    if getattr(old, "web_file_hashes", None) is None:
+        old.web_file_hashes = getattr(cfg, "web_file_hashes", None)
+    old_specs = {x.name: container_spec(x, old)
+                 for x in old_obj.containers.collection}
+    new_specs = {x.name: container_spec(x, cfg)
+                 for x in obj.containers.collection}
+    return {x for x in set(old_specs) | set(new_specs)
+            if old_specs.get(x) != new_specs.get(x)}
+
+
+def image_changes(obj):
+    """The names of containers that are running an older image than the
+one that their image reference (e.g., a tag) now points to"""
+    with docker_client() as cl:
+        found = cl.api.containers(all=True, filters={"name": obj.prefix})
+        images = {}
+        for x in obj.containers.collection:
+            ref = str(x.image)
+            if ref not in images:
+                try:
+                    images[ref] = cl.api.inspect_image(ref)["Id"]
+                except docker.errors.ImageNotFound:
+                    images[ref] = None
+    running = {x["Names"][0].lstrip("/"): x["ImageID"] for x in found}
+    ret = set()
+    for x in obj.containers.collection:
+        external = "{}-{}".format(obj.prefix, x.name)
+        if isinstance(x, constellation.ConstellationService):
+            ids = [v for k, v in running.items()
+                   if k.startswith(external + "-")]
+        else:
+            ids = [running[external]] if external in running else []
+        image_id = images[str(x.image)]
+        if image_id is not None and any(i != image_id for i in ids):
+            print("{} is running an older image than {}".format(
+                x.name, x.image))
+            ret.add(x.name)
+    return ret
+
+
+def upgrade_plan(changed, forced, old_obj, obj):
+    targets = set(changed) | set(forced)
+    if forced:
+        other = targets - with_dependents(forced, old_obj, obj)
+        if other:
+            msg = ("Configuration for {} has also changed; include these"
+                   " components too, or upgrade everything that has"
+                   " changed").format(", ".join(sorted(other)))
+            raise OrderlyWebConfigError(msg)
+    return with_dependents(targets, old_obj, obj)
+
+
+def with_dependents(names, *objs):
+    ret = set(names)
+    for obj in objs:
+        deps = dependents(obj.containers.collection)
+        todo = list(names)
+        while todo:
+            for x in deps.get(todo.pop(), []):
+                if x not in ret:
+                    ret.add(x)
+                    todo.append(x)
+    return ret
+
+
+def component_names(components, cfg, *objs):
+    """Convert components, given either by role (e.g., redis) or
+container name (e.g., redis-ow), into container names"""
+    known = set(x.name for obj in objs for x in obj.containers.collection)
+    ret = set()
+    for x in components:
+        name = cfg.containers.get(x, x)
+        if name not in known:
+            raise OrderlyWebConfigError("Unknown component '{}'".format(x))
+        ret.add(name)
+    return ret
+
+
+def container_spec(x, cfg):
+    """A string describing everything that goes into creating and
+configuring a container, for comparison between configurations"""
+    if isinstance(x, constellation.ConstellationService):
+        spec = {"scale": x.scale, "base": json.loads(
+            container_spec(x.base, cfg))}
+        return json.dumps(spec, sort_keys=True)
+    roles = {v: k for k, v in cfg.containers.items()}
+    fields = CONFIGURE_FIELDS.get(roles.get(x.name), [])
+    spec = {"image": str(x.image),
+            "args": x.args,
+            "mounts": [mount_spec(m, cfg) for m in x.mounts],
+            "ports": x.ports_config,
+            "environment": x.environment,
+            "entrypoint": x.entrypoint,
+            "working_dir": x.working_dir,
+            "labels": x.labels,
+            "configure": {f: getattr(cfg, f, None) for f in fields}}
+    return json.dumps(config_encode_value(spec), sort_keys=True)
+
+
+def mount_spec(mount, cfg):
+    if isinstance(mount, constellation.ConstellationVolumeMount):
+        source = cfg.volumes[mount.name]
+    else:
+        source = mount.source
+    return {"target": mount.target, "source": source, **mount.kwargs}
@@ -0,0 +1,59 @@
+import concurrent.futures
+import re
+
+# Secrets are given in the configuration as 'VAULT:<path>:<key>'.  The
+# same path is often used for several keys (e.g., secret/ssh:public
+# and secret/ssh:private) so rather than resolving each value as we
+# come to it, as constellation.vault does, we collect all references
+# first, read each path once, and read the paths concurrently.  Error
+# messages match those from constellation.vault.
+MAX_READS = 8
+
+RE_VAULT = re.compile("^VAULT:([^:]+):([^:]+)$")
+
+
+def vault_references(x, found=None):
+    """Find all vault references within the attributes of an object
+(or a dictionary), recursing into dictionaries.  Returns a list of
+(container, key, path, field) tuples, so that container[key] can be
+replaced by the value of 'field' at vault path 'path'"""
+    if found is None:
+        found = []
+    items = x if isinstance(x, dict) else vars(x)
+    for k, v in items.items():
+        if isinstance(v, str) and v.startswith("VAULT:"):
+            m = RE_VAULT.match(v)
+            if not m:
+                raise Exception("Invalid vault accessor '{}'".format(v))
+            found.append((items, k) + m.groups())
+        elif isinstance(v, dict):
+            vault_references(v, found)
+    return found
+
+
+def vault_read(client, paths, max_workers=MAX_READS):
+    """Read each of a set of vault paths, concurrently"""
+    paths = sorted(set(paths))
+    if len(paths) == 1:
+        return {paths[0]: client.read(paths[0])}
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        return dict(zip(paths, pool.map(client.read, paths)))
+
+
+def vault_resolve(x, vault_config):
+    """Replace all vault references within an object (or dictionary)
+with their values.  We only authenticate with the vault if there is
+something to look up."""
+    found = vault_references(x)
+    if not found:
+        return
+    data = vault_read(vault_config.client(), [r[2] for r in found])
+    for container, key, path, field in found:
+        secret = data[path]
+        if not secret:
+            raise Exception("Did not find secret at '{}'".format(path))
+        if field not in secret["data"]:
+            msg = "Did not find key '{}' at secret path '{}'".format(
+                field, path)
+            raise Exception(msg)
+        container[key] = secret["data"][field]
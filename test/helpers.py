@@ -0,0 +1,25 @@
+import importlib
+from unittest.mock import patch
+
+
+# helper from https://stackoverflow.com/questions/52324568/
+# how-to-mock-a-function-called-in-a-function-inside-a-module-
+# with-the-same-name
+def module_patch(*args, **kwargs):
+    target = args[0]
+    components = target.split('.')
+    for i in range(len(components), 0, -1):
+        try:
+            # attempt to import the module
+            imported = importlib.import_module('.'.join(components[:i]))
+
+            # module was imported, let's use it in the patch
+            mock = patch(*args, **kwargs)
+            mock.getter = lambda: imported
+            mock.attribute = '.'.join(components[i:])
+            return mock
+        except Exception as exc:
+            pass
+
+    # did not find a module, just return the default mock
+    return patch(*args, **kwargs)
@@ -0,0 +1,100 @@
+from unittest import mock
+
+import pytest
+
+from orderly_web.admin import AdminSession, add_users, image_entrypoint, \
+    operation_args
+from orderly_web.config import build_config
+
+
+def test_operation_args():
+    assert operation_args({"add-users": ["a@x.com", "b@x.com"]}) == \
+        ["add-users", "a@x.com", "b@x.com"]
+    assert operation_args({"add-groups": "funders"}) == \
+        ["add-groups", "funders"]
+    assert operation_args(
+        {"add-members": {"group": "funders", "emails": ["a@x.com"]}}) == \
+        ["add-members", "funders", "a@x.com"]
+    assert operation_args(
+        {"grant": {"group": "funders",
+                   "permissions": ["*/reports.read", "*/reports.run"]}}) == \
+        ["grant", "funders", "*/reports.read", "*/reports.run"]
+
+
+def test_operation_args_validates():
+    with pytest.raises(Exception, match="expected a single entry"):
+        operation_args({"add-users": ["a"], "add-groups": ["b"]})
+    with pytest.raises(Exception, match="expected a single entry"):
+        operation_args("add-users")
+    with pytest.raises(Exception, match="Unknown admin operation 'revoke'"):
+        operation_args({"revoke": ["a"]})
+
+
+def mock_session(entrypoint, exec_results):
+    cfg = build_config("config/basic")
+    client = mock.MagicMock()
+    client.images.get.return_value.attrs = {
+        "Config": {"Entrypoint": entrypoint}}
+    container = client.containers.run.return_value
+    container.exec_run.side_effect = exec_results
+    with mock.patch("orderly_web.admin.fetch_config", return_value=cfg), \
+            mock.patch("orderly_web.admin.docker_client") as docker_client, \
+            mock.patch("orderly_web.admin.docker_util") as util:
+        docker_client.return_value.__enter__.return_value = client
+        session = AdminSession("config/basic")
+        session.start()
+    util.ensure_image.assert_called_once_with(
+        "admin", str(cfg.images["admin"]))
+    return session, client, container
+
+
+def test_admin_session_runs_commands_in_one_container():
+    session, client, container = mock_session(
+        ["/usr/bin/orderly-web-user-cli"],
+        [(0, b"Saved user\n"), (0, b"Gave permission\n")])
+    assert session.add_users(["a@x.com"]) == "Saved user\n"
+    assert session.grant("a@x.com", ["*/reports.read"]) == \
+        "Gave permission\n"
+    assert client.containers.run.call_count == 1
+    assert client.containers.run.call_args[1]["entrypoint"] == ["sh", "-c"]
+    assert container.exec_run.call_args_list == [
+        mock.call(["/usr/bin/orderly-web-user-cli", "add-users", "a@x.com"]),
+        mock.call(["/usr/bin/orderly-web-user-cli", "grant", "a@x.com",
+                   "*/reports.read"])]
+    session.stop()
+    container.remove.assert_called_once_with(force=True)
+    with pytest.raises(Exception, match="Admin session is not running"):
+        session.add_users(["b@x.com"])
+
+
+def test_admin_session_reports_status():
+    session, client, container = mock_session(None, [(1, b"error")])
+    assert session.exec(["grant", "funders", "*/x"]) == {
+        "args": ["grant", "funders", "*/x"], "output": "error", "status": 1}
+    assert container.exec_run.call_args[0][0] == ["grant", "funders", "*/x"]
+
+
+def test_image_entrypoint():
+    assert image_entrypoint("img", {"Entrypoint": ["/cli"]}) == ["/cli"]
+    assert image_entrypoint("img", {"Entrypoint": None}) == []
+    assert image_entrypoint("img", {}) == []
+    with pytest.raises(Exception, match="'img' has a shell form entrypoint"):
+        image_entrypoint("img", {"Entrypoint": ["/bin/sh", "-c", "/cli"]})
+
+
+def test_single_commands_use_a_session():
+    cfg = build_config("config/basic")
+    client = mock.MagicMock()
+    client.images.get.return_value.attrs = {
+        "Config": {"Entrypoint": ["/cli"]}}
+    container = client.containers.run.return_value
+    container.exec_run.return_value = (0, b"Saved user\n")
+    with mock.patch("orderly_web.admin.fetch_config", return_value=cfg), \
+            mock.patch("orderly_web.admin.docker_client") as docker_client, \
+            mock.patch("orderly_web.admin.docker_util") as util:
+        docker_client.return_value.__enter__.return_value = client
+        assert add_users("config/basic", ["a@x.com"]) == "Saved user\n"
+    util.ensure_image.assert_called_once()
+    container.exec_run.assert_called_once_with(["/cli", "add-users",
+                                                "a@x.com"])
+    container.remove.assert_called_once_with(force=True)
@@ -0,0 +1,45 @@
+import io
+import os
+from unittest import mock
+
+from PIL import Image
+
+from orderly_web.assets import assets_stage, favicon, sha256, web_assets
+from orderly_web.config import build_config
+from orderly_web.docker_helpers import ContainerFiles
+
+
+def test_web_assets(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    cfg = build_config("config/customcss")
+    assets = web_assets(cfg)
+    logo = "/static/public/img/logo/my-test-logo.png"
+    assert set(assets.keys()) == {logo, "/static/public/favicon.ico"}
+    with open(cfg.logo_path, "rb") as f:
+        assert assets[logo] == f.read()
+    img = Image.open(io.BytesIO(assets["/static/public/favicon.ico"]))
+    assert img.format == "ICO"
+
+    assert web_assets(build_config("config/basic")) == {}
+
+
+def test_favicon_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    source = "config/customcss/my-test-favicon.png"
+    ico = favicon(source)
+    assert len(os.listdir(str(tmp_path))) == 1
+    with mock.patch("PIL.Image.open") as image_open:
+        assert favicon(source) == ico
+        image_open.assert_not_called()
+
+
+def test_assets_stage_skips_unchanged():
+    assets = {"/a/b.png": b"same", "/a/c.ico": b"new"}
+    container = mock.Mock()
+    out = "{}  /a/b.png\n".format(sha256(b"same"))
+    container.exec_run.return_value = (1, out.encode("UTF-8"))
+    files = ContainerFiles()
+    assets_stage(container, files, assets)
+    container.exec_run.assert_called_once_with(
+        ["sha256sum", "/a/b.png", "/a/c.ico"])
+    assert [x[0].name for x in files.entries] == ["a/c.ico"]
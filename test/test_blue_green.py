@@ -0,0 +1,186 @@
+from unittest import mock
+
+import pytest
+
+from orderly_web.blue_green import blue_green_check, network_aliases, \
+    network_reconnect, proxy_draining, proxy_switch_upstream, \
+    web_blue_green
+from orderly_web.config import build_config
+from orderly_web.errors import OrderlyWebConfigError
+from orderly_web.upgrade import upgrade
+
+from helpers import module_patch
+
+
+def no_dev_mode():
+    # A new list each time, as building a configuration modifies the
+    # options that it is given
+    return [{"web": {"dev_mode": False}}]
+
+
+def test_blue_green_needs_proxy_without_dev_mode():
+    blue_green_check(build_config("config/basic", options=no_dev_mode()))
+    with pytest.raises(OrderlyWebConfigError, match="requires the proxy"):
+        blue_green_check(build_config("config/noproxy"))
+    with pytest.raises(OrderlyWebConfigError, match="dev_mode"):
+        blue_green_check(build_config("config/basic"))
+
+
+def test_proxy_switch_upstream():
+    proxy = mock.Mock()
+    with mock.patch("constellation.docker_util.exec_safely") as exec_safely:
+        proxy_switch_upstream(proxy, "orderly-web-web:8888",
+                              "orderly-web-web-next:8888")
+    args = exec_safely.call_args[0]
+    assert args[0] is proxy
+    assert args[1][:2] == ["sh", "-c"]
+    script = args[1][2]
+    assert "grep -rlF 'orderly-web-web:8888' /etc/nginx" in script
+    assert "s/orderly-web-web:8888/orderly-web-web-next:8888/g" in script
+    assert script.endswith("nginx -t && nginx -s reload")
+
+
+def test_network_aliases_excludes_short_id():
+    container = mock.Mock(id="0123456789abcdef")
+    container.attrs = {"NetworkSettings": {"Networks": {"nw": {
+        "Aliases": ["web", "0123456789ab"]}}}}
+    assert network_aliases(container, "nw") == ["web"]
+    container.attrs["NetworkSettings"]["Networks"]["nw"]["Aliases"] = None
+    assert network_aliases(container, "nw") == []
+
+
+def test_network_reconnect():
+    container = mock.Mock()
+    with module_patch("orderly_web.blue_green.docker_client") as client:
+        network_reconnect(container, "nw", ["web"])
+    cl = client.return_value.__enter__.return_value
+    cl.networks.get.assert_called_once_with("nw")
+    nw = cl.networks.get.return_value
+    nw.disconnect.assert_called_once_with(container)
+    nw.connect.assert_called_once_with(container, aliases=["web"])
+
+
+def test_proxy_draining_looks_for_old_workers():
+    proxy = mock.Mock()
+    proxy.exec_run.return_value = (0, b"")
+    assert proxy_draining(proxy)
+    script = proxy.exec_run.call_args[0][0][2]
+    assert "shutting [d]own" in script
+    proxy.exec_run.return_value = (1, b"")
+    assert not proxy_draining(proxy)
+
+
+class FakeWeb:
+    # Copied (shallowly) for the new web container, so the copy shares
+    # the containers and records its calls in the same list
+    def __init__(self, containers):
+        self.name = "web"
+        self.containers = containers
+        self.calls = []
+
+    def name_external(self, prefix):
+        return "{}-{}".format(prefix, self.name)
+
+    def get(self, prefix):
+        return self.containers[self.name]
+
+    def start(self, *args):
+        self.calls.append(("start", self.name))
+
+    def stop(self, prefix, kill=False):
+        self.calls.append(("stop", self.name))
+
+    def remove(self, prefix):
+        self.calls.append(("remove", self.name))
+
+
+def blue_green_objects():
+    cfg = build_config("config/basic", options=no_dev_mode())
+    live = mock.Mock(id="0123456789abcdef")
+    live.attrs = {"NetworkSettings": {"Networks": {cfg.network: {
+        "Aliases": ["web", "0123456789ab"]}}}}
+    web = FakeWeb({"web": live, "web-next": mock.Mock()})
+    proxy = mock.Mock()
+    obj = mock.Mock(prefix="orderly-web")
+    obj.containers.find.side_effect = \
+        lambda name: web if name == "web" else mock.Mock(
+            get=mock.Mock(return_value=proxy))
+    return cfg, obj, web, proxy
+
+
+def test_web_blue_green_waits_for_http_and_keeps_aliases():
+    cfg, obj, web, proxy = blue_green_objects()
+    new = web.containers["web-next"]
+    upstream = "orderly-web-web:{}".format(cfg.web_port)
+    upstream_next = "orderly-web-web-next:{}".format(cfg.web_port)
+    with module_patch("orderly_web.blue_green.container_http_status",
+                      side_effect=[None, 503, 200]) as status, \
+            module_patch("orderly_web.blue_green.network_reconnect") as rc, \
+            module_patch("orderly_web.blue_green.proxy_draining",
+                         side_effect=[True, False]) as draining, \
+            module_patch("orderly_web.blue_green.proxy_switch_upstream") \
+            as switch:
+        web_blue_green(obj, cfg)
+    assert status.call_count == 3
+    assert status.call_args[0] == (new, cfg.web_port, "/api/v2")
+    rc.assert_called_once_with(new, cfg.network, ["web"])
+    assert draining.call_count == 2
+    assert switch.call_args_list == [
+        mock.call(proxy, upstream, upstream_next),
+        mock.call(proxy, upstream_next, upstream)]
+    new.rename.assert_called_once_with("orderly-web-web")
+    assert web.calls == [("remove", "web-next"), ("start", "web-next"),
+                         ("stop", "web"), ("remove", "web")]
+
+
+def test_web_blue_green_removes_new_container_if_not_ready():
+    cfg, obj, web, proxy = blue_green_objects()
+    with module_patch("orderly_web.blue_green.wait_for",
+                      side_effect=Exception("Timed out")), \
+            module_patch("orderly_web.blue_green.proxy_switch_upstream") \
+            as switch:
+        with pytest.raises(Exception, match="Timed out"):
+            web_blue_green(obj, cfg)
+    switch.assert_not_called()
+    assert web.calls == [("remove", "web-next"), ("start", "web-next"),
+                         ("stop", "web-next"), ("remove", "web-next")]
+
+
+def upgrade_blue_green(options):
+    old = build_config("config/packit", options=no_dev_mode())
+    with module_patch("orderly_web.upgrade.fetch_config",
+                      return_value=old), \
+            module_patch("orderly_web.upgrade.image_changes",
+                         return_value=set()), \
+            module_patch("orderly_web.upgrade.stop_containers") as stop, \
+            module_patch("orderly_web.upgrade.start_constellation"), \
+            module_patch("orderly_web.upgrade.web_blue_green") as swap, \
+            module_patch("orderly_web.upgrade.config_save"):
+        res = upgrade("config/packit", options=no_dev_mode() + options,
+                      blue_green=True)
+    return res, stop, swap
+
+
+def test_upgrade_blue_green_swaps_web_only():
+    options = [{"web": {"image": {"tag": "mrc-1234"}}}]
+    res, stop, swap = upgrade_blue_green(options)
+    assert res == ["web"]
+    stop.assert_not_called()
+    assert swap.call_count == 1
+
+
+def test_upgrade_blue_green_recreates_other_changes_first():
+    options = [{"web": {"image": {"tag": "mrc-1234"}}},
+               {"orderly": {"workers": 2}}]
+    res, stop, swap = upgrade_blue_green(options)
+    assert res == ["orderly-worker", "web"]
+    assert stop.call_args[0][1] == ["orderly-worker"]
+    assert swap.call_count == 1
+
+
+def test_upgrade_blue_green_requires_unchanged_dependencies():
+    options = [{"web": {"image": {"tag": "mrc-1234"}}},
+               {"orderly": {"image": {"tag": "mrc-1234"}}}]
+    with pytest.raises(OrderlyWebConfigError,
+                       match="only possible if neither"):
+        upgrade_blue_green(options)
@@ -0,0 +1,52 @@
+import os
+import stat
+import time
+
+from orderly_web.cache import cache_dir, cache_evict, cache_read, \
+    cache_write
+
+
+def test_cache_roundtrip(tmp_path, monkeypatch):
+    root = str(tmp_path / "cache")
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", root)
+    assert cache_dir() == root
+    assert cache_read("thing") is None
+    cache_write("thing", "contents")
+    assert cache_read("thing") == b"contents"
+    cache_write("thing", b"updated")
+    assert cache_read("thing") == b"updated"
+    assert stat.S_IMODE(os.stat(root).st_mode) == 0o700
+    path = os.path.join(root, "thing")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_cache_dir_is_made_private(tmp_path, monkeypatch):
+    root = str(tmp_path / "cache")
+    os.makedirs(root, mode=0o755)
+    os.chmod(root, 0o755)
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", root)
+    cache_dir()
+    assert stat.S_IMODE(os.stat(root).st_mode) == 0o700
+
+
+def test_cache_expires(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    cache_write("thing", "contents")
+    old = time.time() - 100
+    os.utime(os.path.join(str(tmp_path), "thing"), (old, old))
+    assert cache_read("thing", ttl=1000) == b"contents"
+    assert cache_read("thing", ttl=10) is None
+
+
+def test_cache_evict_keeps_most_recent(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    for i in range(4):
+        cache_write("entry-{}".format(i), "contents")
+        t = time.time() - 100 + i
+        os.utime(os.path.join(str(tmp_path), "entry-{}".format(i)), (t, t))
+    cache_write("other", "contents")
+    cache_evict("entry-", 2)
+    assert sorted(os.listdir(str(tmp_path))) == ["entry-2", "entry-3",
+                                                 "other"]
+    cache_evict("entry-", 0)
+    assert os.listdir(str(tmp_path)) == ["other"]
@@ -8,14 +8,14 @@ from orderly_web.cli import string_to_dict
 def test_cli_parse_start():
     target, args = orderly_web.cli.parse_args(["start", "path"])
     assert target == orderly_web.start
-    assert args == ("path", None, [], False)
+    assert args == ("path", None, [], False, False, None)
 
 
 def test_cli_parse_start_with_extra():
     target, args = orderly_web.cli.parse_args(
         ["start", "path", "--extra=extra.yml"])
     assert target == orderly_web.start
-    assert args == ("path", "extra.yml", [], False)
+    assert args == ("path", "extra.yml", [], False, False, None)
 
 
 def test_cli_parse_start_with_options():
@@ -23,13 +23,60 @@ def test_cli_parse_start_with_options():
         ["start", "path", "--option=a=x", "--option=b.c=y"])
     assert target == orderly_web.start
     options = [{'a': 'x'}, {'b': {'c': 'y'}}]
-    assert args == ("path", None, options, False)
+    assert args == ("path", None, options, False, False, None)
+
+
+def test_cli_parse_start_with_force_migrate():
+    target, args = orderly_web.cli.parse_args(
+        ["start", "path", "--pull", "--force-migrate"])
+    assert target == orderly_web.start
+    assert args == ("path", None, [], True, True, None)
+
+
+def test_cli_parse_start_with_trace():
+    target, args = orderly_web.cli.parse_args(
+        ["start", "path", "--trace=trace.json"])
+    assert target == orderly_web.start
+    assert args == ("path", None, [], False, False, "trace.json")
+
+
+def test_cli_parse_upgrade():
+    target, args = orderly_web.cli.parse_args(["upgrade", "path"])
+    assert target == orderly_web.upgrade
+    assert args == ("path", None, [], False, [], False)
+
+    target, args = orderly_web.cli.parse_args(
+        ["upgrade", "path", "--option=a=x", "--pull",
+         "--component=web", "--component=proxy", "--blue-green"])
+    assert args == ("path", None, [{"a": "x"}], True, ["web", "proxy"], True)
+
+
+def test_cli_parse_scale():
+    target, args = orderly_web.cli.parse_args(["scale", "path", "3"])
+    assert target == orderly_web.scale
+    assert args == ("path", 3)
+    with pytest.raises(Exception, match="Invalid number of workers 'x'"):
+        orderly_web.cli.parse_args(["scale", "path", "x"])
 
 
 def test_cli_parse_status():
     target, args = orderly_web.cli.parse_args(["status", "path"])
     assert target == orderly_web.status
-    assert args == ("path",)
+    assert args == ("path", False, False)
+    target, args = orderly_web.cli.parse_args(
+        ["status", "path", "--json", "--watch"])
+    assert args == ("path", True, True)
+
+
+def test_cli_parse_health():
+    target, args = orderly_web.cli.parse_args(["health", "path"])
+    assert target == orderly_web.health
+    assert args == ("path", False, 5.0)
+    target, args = orderly_web.cli.parse_args(
+        ["health", "path", "--json", "--timeout=0.5"])
+    assert args == ("path", True, 0.5)
+    with pytest.raises(Exception, match="Invalid timeout 'x'"):
+        orderly_web.cli.parse_args(["health", "path", "--timeout=x"])
 
 
 def test_cli_parse_stop():
@@ -127,3 +174,20 @@ def test_string_to_dict():
     msg = "Invalid value '{}' - expected simple type"
     with pytest.raises(Exception, match=msg):
         string_to_dict("a={}")
+
+
+def test_cli_parse_apply():
+    target, args = orderly_web.cli.parse_args(
+        ["admin", "path", "apply", "users.yml"])
+    assert target == orderly_web.apply_file
+    assert args == ("path", "users.yml")
+
+
+def test_cli_parse_sync():
+    target, args = orderly_web.cli.parse_args(
+        ["admin", "path", "sync", "users.yml"])
+    assert target == orderly_web.sync_permissions
+    assert args == ("path", "users.yml", False)
+    target, args = orderly_web.cli.parse_args(
+        ["admin", "path", "sync", "users.yml", "--dry-run"])
+    assert args == ("path", "users.yml", True)
@@ -1,11 +1,16 @@
+import hashlib
 import io
 from contextlib import redirect_stdout
 import pytest
 import shutil
 import tempfile
+import threading
+import time
 import yaml
+from unittest import mock
 
 from orderly_web.config import *
+from orderly_web.errors import OrderlyWebConfigError
 
 sample_data = {"a": "value1", "b": {"x": "value2"}, "c": 1, "d": True,
                "e": None}
@@ -89,6 +94,19 @@ def test_config_custom_styles():
     assert cfg.favicon_path == expected_icon_path
 
 
+def test_config_record_files():
+    cfg = build_config("config/basic")
+    cfg.record_files()
+    assert cfg.web_file_hashes == {}
+    cfg = build_config("config/customcss")
+    cfg.record_files()
+    assert set(cfg.web_file_hashes) == {"logo_path", "favicon_path",
+                                        "sass_variables"}
+    with open(cfg.sass_variables, "rb") as f:
+        assert cfg.web_file_hashes["sass_variables"] == \
+            hashlib.sha256(f.read()).hexdigest()
+
+
 def test_config_montagu():
     path = "config/montagu"
     cfg = build_config(path)
@@ -109,6 +127,37 @@ def test_multiple_workers_config():
     assert cfg.workers == 2
 
 
+def test_orderly_ready_timeout():
+    cfg = build_config("config/basic")
+    assert cfg.orderly_ready_timeout == 60
+    options = {"orderly": {"ready_timeout": 5}}
+    cfg = build_config("config/basic", options=options)
+    assert cfg.orderly_ready_timeout == 5
+
+
+def test_orderly_ssh_known_hosts():
+    ssh = {"public": "pub", "private": "priv"}
+    cfg = build_config("config/basic", options={"orderly": {"ssh": ssh}})
+    assert cfg.orderly_ssh == ssh
+    ssh = {"public": "pub", "private": "priv", "known_hosts": "hosts"}
+    cfg = build_config("config/basic", options={"orderly": {"ssh": ssh}})
+    assert cfg.orderly_ssh == ssh
+
+
+def test_orderly_initial_clone_options():
+    cfg = build_config("config/basic")
+    assert cfg.orderly_initial_depth is None
+    assert cfg.orderly_initial_branch is None
+    assert cfg.orderly_initial_reference is None
+    options = {"orderly": {"initial": {"depth": 1, "branch": "main",
+                                       "reference": "mirror.git"}}}
+    cfg = build_config("config/basic", options=options)
+    assert cfg.orderly_initial_depth == 1
+    assert cfg.orderly_initial_branch == "main"
+    assert cfg.orderly_initial_reference == \
+        os.path.abspath("config/basic/mirror.git")
+
+
 def test_config_no_proxy():
     cfg = build_config("config/noproxy")
     assert not cfg.proxy_enabled
@@ -301,3 +350,192 @@ def test_packit_disabled_if_no_config():
 def read_file(path):
     with open(path, "r") as f:
         return f.read()
+
+
+def test_config_is_cached(tmp_path, monkeypatch):
+    cache = str(tmp_path / "cache")
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", cache)
+    path = str(tmp_path / "config")
+    shutil.copytree("config/basic", path)
+    options = [{"web": {"port": 9000}}]
+    cfg = build_config(path, options=options)
+    assert cfg.web_port == 9000
+    with mock.patch.object(OrderlyWebConfigBase, "build") as build:
+        cached = build_config(path, options=options)
+        build.assert_not_called()
+    assert cached.web_port == 9000
+    assert cached.path == path
+
+    # Changing the options or the file invalidates the cache:
+    assert build_config(path, options=[{"web": {"port": 9001}}]).web_port \
+        == 9001
+    assert len(os.listdir(cache)) == 3
+    with open(os.path.join(path, "orderly-web.yml"), "a") as f:
+        f.write("\n# a comment\n")
+    build_config(path, options=options)
+    assert len(os.listdir(cache)) == 5
+
+
+def test_config_cache_depends_on_env_vars(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    path = str(tmp_path / "config")
+    shutil.copytree("config/basic", path)
+    with open(os.path.join(path, "orderly-web.yml"), "a") as f:
+        f.write("\nnotes: $ORDERLY_WEB_TEST_NOTE\n")
+    monkeypatch.setenv("ORDERLY_WEB_TEST_NOTE", "a")
+    assert build_config(path).data["notes"] == "a"
+    monkeypatch.setenv("ORDERLY_WEB_TEST_NOTE", "b")
+    assert build_config(path).data["notes"] == "b"
+
+
+def test_config_cache_rebuilds_invalid_entries(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    key = config_cache_key("build", "config/basic", None, None)
+    # An entry written in an older layout, or of the wrong type, is
+    # replaced rather than used
+    for dat in [pickle.dumps(read_config("config/basic")),
+                pickle.dumps({"schema": CONFIG_CACHE_SCHEMA,
+                              "config": read_config("config/basic")}),
+                b"corrupt"]:
+        cache_write(key, dat)
+        cfg = build_config("config/basic")
+        assert type(cfg) is OrderlyWebConfig
+        entry = pickle.loads(cache_read(key))
+        assert entry["schema"] == CONFIG_CACHE_SCHEMA
+        assert type(entry["config"]) is OrderlyWebConfig
+
+
+def test_config_cache_key_depends_on_code(monkeypatch):
+    key = config_cache_key("build", "config/basic", None, None)
+    monkeypatch.setattr("orderly_web.config.constellation_version", "0.0.1")
+    assert config_cache_key("build", "config/basic", None, None) != key
+    monkeypatch.undo()
+    monkeypatch.setattr("orderly_web.config.CONFIG_CACHE_SCHEMA", 0)
+    assert config_cache_key("build", "config/basic", None, None) != key
+
+
+def test_config_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    monkeypatch.setattr("orderly_web.config.CONFIG_CACHE_SIZE", 3)
+    for port in range(9000, 9005):
+        build_config("config/basic", options=[{"web": {"port": port}}])
+    assert len([x for x in os.listdir(str(tmp_path))
+                if x.startswith("config-")]) == 3
+
+
+def test_config_serialise_roundtrip():
+    for path in ["config/basic", "config/complete", "config/customcss",
+                 "config/packit", "config/montagu"]:
+        cfg = build_config(path)
+        txt = config_serialise(cfg)
+        dat = json.loads(txt)
+        assert dat["version"] == CONFIG_FORMAT_VERSION
+        assert "data" not in dat["fields"]
+        restored = config_deserialise(txt, "elsewhere")
+        assert restored.path == "elsewhere"
+        for k, v in vars(cfg).items():
+            if k not in ["path", "data"]:
+                assert config_encode_value(getattr(restored, k)) == \
+                    config_encode_value(v)
+        assert str(restored.images["web"]) == str(cfg.images["web"])
+        assert restored.vault.url == cfg.vault.url
+
+
+def test_config_fields_decoded_lazily():
+    cfg = build_config("config/basic")
+    restored = config_deserialise(config_serialise(cfg), "config/basic")
+    assert "containers" not in vars(restored)
+    assert restored.containers == cfg.containers
+    assert "containers" in vars(restored)
+    assert "images" not in vars(restored)
+    # Re-serialising keeps both decoded and undecoded fields
+    again = json.loads(config_serialise(restored))
+    assert again == json.loads(config_serialise(cfg))
+
+
+def test_config_fields_decoded_on_many_threads():
+    # Configure hooks read the same fields on many threads at once; a
+    # slow decode makes sure that they overlap
+    cfg = build_config("config/complete")
+    restored = config_deserialise(config_serialise(cfg), "config/complete")
+    barrier = threading.Barrier(16, timeout=5)
+    errors = []
+
+    def decode(x):
+        time.sleep(0.05)
+        return x
+
+    def read():
+        barrier.wait()
+        try:
+            assert restored.orderly_ssh == cfg.orderly_ssh
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read) for i in range(16)]
+    with mock.patch("orderly_web.config.config_decode_value",
+                    side_effect=decode):
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert errors == []
+
+
+def test_config_missing_field_is_attribute_error():
+    cfg = build_config("config/basic")
+    restored = config_deserialise(config_serialise(cfg), "config/basic")
+    del restored._fields["outpack_enabled"]
+    with pytest.raises(AttributeError):
+        restored.outpack_enabled
+
+
+def test_config_force_migrate_not_saved():
+    cfg = build_config("config/basic")
+    assert not cfg.web_force_migrate
+    cfg.web_force_migrate = True
+    txt = config_serialise(cfg)
+    assert "web_force_migrate" not in json.loads(txt)["fields"]
+    assert not config_deserialise(txt, "config/basic").web_force_migrate
+
+
+def test_config_deserialise_checks_version():
+    txt = json.dumps({"version": 999, "fields": {}})
+    with pytest.raises(OrderlyWebConfigError, match="format version 999"):
+        config_deserialise(txt, "config/basic")
+
+
+def test_config_deserialise_reads_pickled_config():
+    cfg = build_config("config/basic")
+    txt = base64.b64encode(pickle.dumps(cfg)).decode("utf8")
+    restored = config_deserialise(txt, "other")
+    assert restored.path == "other"
+    assert restored.web_port == cfg.web_port
+
+
+def test_fetch_config_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    cfg = build_config("config/basic")
+    txt = config_serialise(cfg)
+    container = mock.Mock()
+    container.name = "orderly-web-orderly"
+    container.attrs = {"Id": "abc", "State": {"StartedAt": "2024-01-01"}}
+    cl = mock.MagicMock()
+    cl.containers.get.return_value = container
+    with mock.patch("orderly_web.config.docker_client") as client, \
+            mock.patch("orderly_web.config.docker_util") as util:
+        client.return_value.__enter__.return_value = cl
+        util.string_from_container.return_value = txt
+        assert fetch_config("config/basic").web_port == cfg.web_port
+        assert fetch_config("config/basic").web_port == cfg.web_port
+        assert util.string_from_container.call_count == 1
+        cl.containers.get.assert_called_with("orderly-web-orderly")
+
+        # A restarted container is read again, and only the latest
+        # copy is kept
+        container.attrs["State"]["StartedAt"] = "2024-01-02"
+        fetch_config("config/basic")
+        assert util.string_from_container.call_count == 2
+    fetched = [x for x in os.listdir(str(tmp_path))
+               if x.startswith("fetched-")]
+    assert fetched == [fetched_config_key(container)]
@@ -0,0 +1,182 @@
+from unittest import mock
+
+import docker
+
+from orderly_web.config import build_config
+from orderly_web.constellation import orderly_constellation, \
+    orderly_init_clone, orderly_known_hosts, orderly_schema_hash, \
+    web_generate_css, web_migrate, web_migrate_marker
+from orderly_web.docker_helpers import ContainerFiles
+
+
+def test_known_hosts_from_config():
+    container = mock.Mock()
+    ssh = {"public": "pub", "private": "priv", "known_hosts": "hosts"}
+    assert orderly_known_hosts(ssh, container) == "hosts"
+    container.exec_run.assert_not_called()
+
+
+def test_known_hosts_scanned_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDERLY_WEB_CACHE", str(tmp_path))
+    container = mock.Mock()
+    container.exec_run.return_value = (0, b"github.com ssh-rsa AAAA\n")
+    ssh = {"public": "pub", "private": "priv"}
+    assert orderly_known_hosts(ssh, container) == "github.com ssh-rsa AAAA\n"
+    assert orderly_known_hosts(ssh, container) == "github.com ssh-rsa AAAA\n"
+    container.exec_run.assert_called_once_with(["ssh-keyscan", "github.com"])
+
+
+def test_css_generation_skipped_if_unchanged():
+    cfg = build_config("config/customcss")
+    container = mock.Mock()
+    cl = mock.MagicMock()
+    cl.images.get.return_value.id = "sha256:abc"
+    with mock.patch("orderly_web.constellation.docker_util") as util, \
+            mock.patch("orderly_web.constellation.docker_client") as client:
+        client.return_value.__enter__.return_value = cl
+        container.exec_run.return_value = (1, b"")
+        files = ContainerFiles()
+        web_generate_css(container, files, cfg)
+        assert cl.containers.run.call_count == 1
+        assert len(files.entries) == 1
+        info, key = files.entries[0]
+        assert info.name == "static/public/css/.orderly-web-css"
+
+        container.exec_run.return_value = (0, key + b"\n")
+        files = ContainerFiles()
+        web_generate_css(container, files, cfg)
+        assert cl.containers.run.call_count == 1
+        assert files.entries == []
+
+        cl.images.get.return_value.id = "sha256:def"
+        web_generate_css(container, files, cfg)
+        assert cl.containers.run.call_count == 2
+
+
+def test_orderly_schema_hash():
+    cfg = mock.Mock()
+    container = cfg.get_container.return_value
+    container.exec_run.return_value = (0, b"table report CREATE TABLE\n")
+    h = orderly_schema_hash(cfg)
+    assert len(h) == 64
+    cfg.get_container.assert_called_once_with("orderly")
+    args = container.exec_run.call_args[0][0]
+    assert args[:2] == ["Rscript", "-e"]
+    assert "sqlite_master" in args[2]
+
+    container.exec_run.return_value = (0, b"table report CREATE TABLE\n"
+                                          b"table user CREATE TABLE\n")
+    assert orderly_schema_hash(cfg) != h
+    container.exec_run.return_value = (1, b"")
+    assert orderly_schema_hash(cfg) is None
+
+
+def test_web_migrate_skipped_if_current():
+    cfg = build_config("config/basic")
+    container = mock.Mock()
+    cl = mock.MagicMock()
+    cl.images.get.return_value.id = "sha256:abc"
+    container.exec_run.return_value = (0, b"sha256:abc 7f\n")
+    with mock.patch("orderly_web.constellation.docker_util"), \
+            mock.patch("orderly_web.constellation.orderly_schema_hash",
+                       return_value="7f") as schema, \
+            mock.patch("orderly_web.constellation.docker_client") as client:
+        client.return_value.__enter__.return_value = cl
+        web_migrate(container, cfg)
+        cl.containers.run.assert_not_called()
+        container.put_archive.assert_not_called()
+
+        # A rebuilt database has a different schema
+        schema.return_value = "80"
+        web_migrate(container, cfg)
+        assert cl.containers.run.call_count == 1
+        container.put_archive.assert_called_once()
+
+        schema.return_value = "7f"
+        cfg.web_force_migrate = True
+        web_migrate(container, cfg)
+        assert cl.containers.run.call_count == 2
+
+        # Always migrate if the schema can't be read
+        cfg.web_force_migrate = False
+        schema.return_value = None
+        web_migrate(container, cfg)
+        assert cl.containers.run.call_count == 3
+        assert container.put_archive.call_count == 2
+
+
+def test_web_migrate_marker_outside_git_worktree():
+    container = mock.Mock()
+    container.exec_run.return_value = (0, b"")
+    assert web_migrate_marker(container) == \
+        "/orderly/.git/orderly-web-migrate"
+    container.exec_run.assert_called_once_with(
+        ["test", "-d", "/orderly/.git"])
+    container.exec_run.return_value = (1, b"")
+    assert web_migrate_marker(container) == "/orderly/.orderly-web-migrate"
+
+
+def test_web_migrate_removes_old_marker():
+    cfg = build_config("config/basic")
+    container = mock.Mock()
+    container.exec_run.return_value = (0, b"")
+    with mock.patch("orderly_web.constellation.docker_util"), \
+            mock.patch("orderly_web.constellation.orderly_schema_hash",
+                       return_value="7f"), \
+            mock.patch("orderly_web.constellation.docker_client"):
+        web_migrate(container, cfg)
+    calls = [x[0][0] for x in container.exec_run.call_args_list]
+    assert ["cat", "/orderly/.git/orderly-web-migrate"] in calls
+    assert calls[-1] == ["rm", "-f", "/orderly/.orderly-web-migrate"]
+    container.put_archive.assert_called_once()
+
+
+def test_orderly_init_clone_options():
+    options = {"orderly": {"initial": {"depth": 1, "branch": "main",
+                                       "reference": "/mirror.git"}}}
+    cfg = build_config("config/basic", options=options)
+    container = mock.Mock()
+    container.exec_run.return_value = (0, b"")
+    orderly_init_clone(container, cfg)
+    assert container.exec_run.call_args_list == [
+        mock.call(["test", "-d", "/orderly-reference"]),
+        mock.call(["git", "clone", "--depth", "1", "--branch", "main",
+                   "--single-branch", "--reference", "/orderly-reference",
+                   "--dissociate",
+                   "https://github.com/reside-ic/orderly-example",
+                   "/orderly"])]
+
+
+def test_orderly_init_clone_without_reference_mount():
+    options = {"orderly": {"initial": {"reference": "/mirror.git"}}}
+    cfg = build_config("config/basic", options=options)
+    container = mock.Mock()
+    container.exec_run.side_effect = [(1, b""), (0, b"")]
+    orderly_init_clone(container, cfg)
+    assert container.exec_run.call_args[0][0] == [
+        "git", "clone", "https://github.com/reside-ic/orderly-example",
+        "/orderly"]
+
+
+def test_orderly_reference_mounted_only_for_new_volume(tmp_path):
+    options = {"orderly": {"initial": {"reference": str(tmp_path)}}}
+    cfg = build_config("config/basic", options=options)
+    cl = mock.MagicMock()
+    cl.volumes.get.side_effect = docker.errors.NotFound("missing")
+    with mock.patch("orderly_web.constellation.docker_client") as client:
+        client.return_value.__enter__.return_value = cl
+        orderly = orderly_constellation(cfg).containers.find("orderly")
+        mount = orderly.mounts[-1].to_mount(None)
+        assert mount["Source"] == str(tmp_path)
+        assert mount["Target"] == "/orderly-reference"
+        assert mount["ReadOnly"]
+
+        # Once the volume exists the reference is no longer needed
+        cl.volumes.get.side_effect = None
+        orderly = orderly_constellation(cfg).containers.find("orderly")
+        assert len(orderly.mounts) == 1
+
+    # Nor is it mounted if it has gone
+    cfg.orderly_initial_reference = str(tmp_path / "missing")
+    orderly = orderly_constellation(cfg).containers.find("orderly")
+    assert len(orderly.mounts) == 1
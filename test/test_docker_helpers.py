@@ -0,0 +1,80 @@
+import io
+import tarfile
+from unittest import mock
+
+import pytest
+
+from orderly_web.docker_helpers import ContainerFiles, \
+    container_http_status, container_port_open, wait_for
+
+
+def test_wait_for_returns_once_check_passes():
+    check = mock.Mock(side_effect=[False, False, True])
+    wait_for(check, "thing", 5, poll=0.01)
+    assert check.call_count == 3
+
+
+def test_wait_for_times_out():
+    check = mock.Mock(return_value=False)
+    with pytest.raises(Exception, match="Timed out waiting for thing"):
+        wait_for(check, "thing", 0.1, poll=0.01)
+
+
+def test_container_port_open_uses_exit_code():
+    container = mock.Mock()
+    container.exec_run.return_value = (0, b"")
+    assert container_port_open(container, 8321)
+    args = container.exec_run.call_args[0][0]
+    assert args == ["bash", "-c", "exec 3<>/dev/tcp/localhost/8321"]
+    container.exec_run.return_value = (1, b"")
+    assert not container_port_open(container, 8321)
+
+
+def test_container_http_status_reads_status_line():
+    container = mock.Mock()
+    container.exec_run.return_value = (0, b"HTTP/1.1 200 OK\r\n")
+    assert container_http_status(container, 8888, "/api/v2") == 200
+    args = container.exec_run.call_args[0][0]
+    assert args[:2] == ["bash", "-c"]
+    assert args[2].startswith("exec 3<>/dev/tcp/localhost/8888 && ")
+    assert "GET /api/v2 HTTP/1.0" in args[2]
+    container.exec_run.return_value = (0, b"HTTP/1.1 503 Unavailable\r\n")
+    assert container_http_status(container, 8888, "/") == 503
+    container.exec_run.return_value = (1, b"")
+    assert container_http_status(container, 8888, "/") is None
+    container.exec_run.return_value = (0, b"garbage\n")
+    assert container_http_status(container, 8888, "/") is None
+
+
+def test_container_files_sends_single_archive(tmp_path):
+    local = tmp_path / "script"
+    local.write_text("#!/usr/bin/env bash\n")
+    local.chmod(0o755)
+    files = ContainerFiles()
+    files.directory("/root/.ssh", 0o700)
+    files.string("/root/.ssh/id_rsa", "secret", 0o600)
+    files.bytes("/static/favicon.ico", b"\x00\x01")
+    files.file("/wait_for_redis", str(local))
+    container = mock.Mock()
+    files.put(container)
+
+    container.put_archive.assert_called_once()
+    path, data = container.put_archive.call_args[0]
+    assert path == "/"
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        members = {x.name: x for x in tar.getmembers()}
+        assert list(members.keys()) == [
+            "root/.ssh", "root/.ssh/id_rsa", "static/favicon.ico",
+            "wait_for_redis"]
+        assert members["root/.ssh"].isdir()
+        assert members["root/.ssh"].mode == 0o700
+        assert members["root/.ssh/id_rsa"].mode == 0o600
+        assert members["wait_for_redis"].mode == 0o755
+        assert tar.extractfile("root/.ssh/id_rsa").read() == b"secret"
+        assert tar.extractfile("static/favicon.ico").read() == b"\x00\x01"
+
+
+def test_container_files_does_nothing_if_empty():
+    container = mock.Mock()
+    ContainerFiles().put(container)
+    container.put_archive.assert_not_called()
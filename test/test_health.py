@@ -0,0 +1,153 @@
+import http.server
+import io
+import json
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager, redirect_stdout
+from unittest import mock
+
+import pytest
+
+from orderly_web.config import build_config
+from orderly_web.health import check_http, check_postgres, check_redis, \
+    container_addresses, health, health_checks, health_probe
+
+from helpers import module_patch
+
+
+@contextmanager
+def local_server(server):
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def http_server(status):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(status)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+    return local_server(http.server.HTTPServer(("127.0.0.1", 0), Handler))
+
+
+def tcp_server(reply):
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.recv(64)
+            self.request.sendall(reply)
+    return local_server(socketserver.TCPServer(("127.0.0.1", 0), Handler))
+
+
+def test_check_http():
+    with http_server(200) as port:
+        assert check_http("127.0.0.1", port, 1) == "HTTP 200"
+    with http_server(302) as port:
+        assert check_http("127.0.0.1", port, 1) == "HTTP 302"
+    with http_server(503) as port:
+        with pytest.raises(Exception, match="HTTP 503"):
+            check_http("127.0.0.1", port, 1)
+
+
+def test_check_redis():
+    with tcp_server(b"+PONG\r\n") as port:
+        assert check_redis("127.0.0.1", port, 1) == "PONG"
+    with tcp_server(b"-LOADING\r\n") as port:
+        with pytest.raises(Exception, match="Unexpected reply"):
+            check_redis("127.0.0.1", port, 1)
+
+
+def test_check_postgres():
+    with tcp_server(b"N") as port:
+        assert check_postgres("127.0.0.1", port, 1) == \
+            "accepting connections"
+    with tcp_server(b"") as port:
+        with pytest.raises(Exception, match="Unexpected reply"):
+            check_postgres("127.0.0.1", port, 1)
+
+
+def test_health_probe_times_out():
+    # A server that accepts the connection but never replies
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    s.listen(1)
+    try:
+        res = health_probe(check_redis, s.getsockname()[1], "127.0.0.1", 0.2)
+    finally:
+        s.close()
+    assert not res["ok"]
+    assert res["detail"] == "timed out after 0.2s"
+    assert 150 < res["latency"] < 2000
+
+
+def test_health_probe_reports_missing_and_refused():
+    assert health_probe(check_http, 80, None, 1) == {
+        "ok": False, "latency": None, "detail": "not running"}
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    res = health_probe(check_http, port, "127.0.0.1", 1)
+    assert not res["ok"]
+    assert res["latency"] is not None
+
+
+def test_health_checks_follow_config():
+    cfg = build_config("config/basic")
+    assert set(health_checks(cfg)) == {"redis", "orderly", "web", "proxy"}
+    cfg = build_config("config/complete")
+    checks = health_checks(cfg)
+    assert set(checks) == {"redis", "orderly", "web", "outpack-server",
+                           "packit-db", "packit-api", "packit", "proxy"}
+    assert checks["packit-db"] == (check_postgres, 5432)
+    assert checks["proxy"] == (check_http, cfg.proxy_port_http)
+
+
+def test_container_addresses():
+    cfg = build_config("config/basic")
+
+    def container(name, network, address):
+        return {"Names": ["/" + name],
+                "NetworkSettings": {"Networks": {
+                    network: {"IPAddress": address}}}}
+    cl = mock.MagicMock()
+    cl.api.containers.return_value = [
+        container("orderly-web-web", cfg.network, "10.0.0.2"),
+        container("orderly-web-orderly", "other", "10.0.1.3"),
+        container("something-else", cfg.network, "10.0.0.4")]
+    with module_patch("orderly_web.health.docker_client") as client:
+        client.return_value.__enter__.return_value = cl
+        assert container_addresses(cfg) == {"web": "10.0.0.2"}
+    assert cl.api.containers.call_count == 1
+
+
+def test_health_reports_all_and_fails_if_any_fail():
+    cfg = build_config("config/basic")
+    with http_server(200) as web, tcp_server(b"+PONG\r\n") as redis:
+        checks = {"web": (check_http, web), "redis": (check_redis, redis),
+                  "orderly": (check_http, web)}
+        addresses = {"web": "127.0.0.1", "redis": "127.0.0.1"}
+        f = io.StringIO()
+        with module_patch("orderly_web.health.fetch_config",
+                          return_value=cfg), \
+                module_patch("orderly_web.health.health_checks",
+                             return_value=checks), \
+                module_patch("orderly_web.health.container_addresses",
+                             return_value=addresses), \
+                redirect_stdout(f):
+            with pytest.raises(Exception, match="Unhealthy: orderly"):
+                health("config/basic", timeout=1)
+            addresses["orderly"] = "127.0.0.1"
+            res = health("config/basic", as_json=True, timeout=1)
+    out = f.getvalue()
+    assert "orderly         FAILED           -  not running" in out
+    assert "PONG" in out
+    assert json.loads(out[out.index("{"):]) == res
+    assert all(x["ok"] for x in res.values())
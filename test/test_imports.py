@@ -0,0 +1,52 @@
+import subprocess
+import sys
+import time
+
+import orderly_web
+import orderly_web.stop
+
+
+def run_python(code):
+    res = subprocess.run([sys.executable, "-c", code], check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True)
+    return res.stdout
+
+
+def imported_modules(code):
+    code += "\nimport sys\nprint('\\n'.join(sys.modules.keys()))"
+    return set(run_python(code).split())
+
+
+def test_cli_imports_are_light():
+    modules = imported_modules("import orderly_web.cli")
+    for m in ["docker", "constellation", "hvac", "PIL", "yaml",
+              "orderly_web.start", "orderly_web.stop"]:
+        assert m not in modules
+
+
+def test_status_does_not_import_pil():
+    modules = imported_modules("import orderly_web\norderly_web.status")
+    assert "orderly_web.status" in modules
+    assert "PIL" not in modules
+
+
+def test_cli_startup_time():
+    # Guard the cost of importing the cli, relative to starting python
+    def elapsed(code):
+        t0 = time.monotonic()
+        run_python(code)
+        return time.monotonic() - t0
+
+    base = min(elapsed("pass") for _ in range(3))
+    cli = min(elapsed("import orderly_web.cli") for _ in range(3))
+    assert cli - base < 0.1
+
+
+def test_exports_are_functions():
+    # Importing the submodule must not replace the exported function
+    assert callable(orderly_web.stop)
+    assert orderly_web.stop.__module__ == "orderly_web.stop"
+    assert set(orderly_web.__all__) == {
+        "pull", "start", "status", "stop", "upgrade", "scale", "health",
+        "add_users", "add_groups", "add_members", "grant", "apply_file",
+        "apply_operations", "AdminSession", "sync_permissions"}
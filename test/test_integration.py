@@ -7,6 +7,9 @@ import time
 import json
 import ssl
 import re
+import shutil
+import subprocess
+import tempfile
 import docker
 from unittest import mock
 from urllib import request
@@ -256,6 +259,66 @@ def test_admin_cli():
         orderly_web.stop(path, kill=True, volumes=True, network=True)
 
 
+def test_admin_apply():
+    path = "config/basic"
+    try:
+        orderly_web.start(path)
+        operations = [
+            {"add-users": ["test.user@gmail.com"]},
+            {"add-groups": ["funders"]},
+            {"add-members": {"group": "funders",
+                             "emails": ["test.user@gmail.com"]}},
+            {"grant": {"group": "funders",
+                       "permissions": ["*/reports.read"]}}]
+        res = orderly_web.apply_operations(path, operations)
+        assert len(res) == 4
+        assert all(x["status"] == 0 for x in res)
+        assert "Saved user with email 'test.user@gmail.com' to the " \
+            "database" in res[0]["output"]
+        assert "Saved user group 'funders' to the database" in \
+            res[1]["output"]
+        assert "Gave user group 'funders' the permission " \
+            "'*/reports.read'" in res[3]["output"]
+    finally:
+        orderly_web.stop(path, kill=True, volumes=True, network=True)
+
+
+def test_admin_session():
+    path = "config/basic"
+    try:
+        orderly_web.start(path)
+        with orderly_web.AdminSession(path) as session:
+            result = session.add_users(["test.user@gmail.com"])
+            assert "Saved user with email 'test.user@gmail.com' to the " \
+                "database" in result
+            result = session.grant("test.user@gmail.com", ["*/reports.read"])
+            assert "the permission '*/reports.read'" in result
+            name = session.container.name
+        cl = docker.client.from_env()
+        assert name not in [x.name for x in cl.containers.list(all=True)]
+    finally:
+        orderly_web.stop(path, kill=True, volumes=True, network=True)
+
+
+def test_admin_sync():
+    path = "config/basic"
+    try:
+        orderly_web.start(path)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "permissions.yml")
+            with open(filename, "w") as f:
+                f.write("groups:\n"
+                        "  funders:\n"
+                        "    members: [test.user@gmail.com]\n"
+                        "    permissions: ['*/reports.read']\n")
+            res = orderly_web.sync_permissions(path, filename)
+            assert [x["args"][0] for x in res] == \
+                ["add-users", "add-groups", "add-members", "grant"]
+            assert orderly_web.sync_permissions(path, filename) == []
+    finally:
+        orderly_web.stop(path, kill=True, volumes=True, network=True)
+
+
 def test_no_devmode_no_ports():
     path = "config/noproxy"
     options = {"web": {"dev_mode": False,
@@ -431,6 +494,39 @@ def test_can_start_with_prepared_volume():
         orderly_web.stop(path, kill=True, volumes=True, network=True)
 
 
+def test_can_start_with_shallow_reference_clone():
+    path = "config/basic"
+    url = "https://github.com/reside-ic/orderly-example"
+    with tempfile.TemporaryDirectory() as tmp:
+        mirror = os.path.join(tmp, "mirror.git")
+        subprocess.run(["git", "clone", "--bare", url, mirror], check=True)
+        options = {"orderly": {"initial": {"source": "clone",
+                                           "url": url,
+                                           "depth": 1,
+                                           "reference": mirror}}}
+        cfg = build_config(path, options=options)
+        with docker_client() as cl:
+            docker_util.remove_volume(cfg.volumes["orderly"])
+        try:
+            orderly_web.start(path, options=options)
+            orderly = cfg.get_container("orderly")
+            res = docker_util.exec_safely(
+                orderly, ["git", "-C", "/orderly", "rev-parse",
+                          "--is-shallow-repository"])
+            assert res[1].decode("UTF-8").strip() == "true"
+            res = orderly.exec_run(
+                ["stat", "/orderly/.git/objects/info/alternates"])
+            assert res[0] != 0
+
+            # The mirror is only needed for the first clone
+            orderly_web.stop(path, kill=True)
+            shutil.rmtree(mirror)
+            orderly_web.start(path, options=options)
+            assert docker_util.container_exists("orderly-web-orderly")
+        finally:
+            orderly_web.stop(path, kill=True, volumes=True, network=True)
+
+
 def test_can_start_with_outpack():
     path = "config/basic"
     options = {"outpack": {"repo": "mrcide",
@@ -467,17 +563,43 @@ def test_can_start_with_packit():
         orderly_web.stop(path, kill=True, volumes=True, network=True)
 
 
-def test_notifies_slack_on_success():
+def test_health_of_packit_deployment():
+    path = "config/packit"
+    try:
+        orderly_web.start(path)
+        res = orderly_web.health(path)
+        assert set(res) >= {"redis", "orderly", "web", "outpack-server",
+                            "packit-db", "packit-api", "packit"}
+        assert all(x["ok"] for x in res.values())
+
+        docker.client.from_env().containers.get(
+            "orderly-web-redis-ow").stop()
+        with pytest.raises(Exception, match="Unhealthy: redis"):
+            orderly_web.health(path, timeout=1)
+    finally:
+        orderly_web.stop(path, kill=True, volumes=True, network=True)
+
+
+def test_notifies_slack_on_success(tmp_path):
+    trace = str(tmp_path / "trace.json")
     with patch.object(Notifier, 'post',
                       return_value=None) as mock_notify:
         path = "config/basic"
         try:
-            orderly_web.start(path)
+            orderly_web.start(path, trace=trace)
         finally:
             orderly_web.stop(path, kill=True, volumes=True, network=True)
-    calls = [call("*Starting* deploy to https://localhost"),
-             call("*Completed* deploy to https://localhost :shipit:")]
-    mock_notify.assert_has_calls(calls)
+    assert mock_notify.call_count == 2
+    assert mock_notify.call_args_list[0] == \
+        call("*Starting* deploy to https://localhost")
+    msg = mock_notify.call_args_list[1][0][0]
+    assert msg.startswith(
+        "*Completed* deploy to https://localhost :shipit: in")
+    assert "slowest: " in msg
+    with open(trace) as f:
+        names = set(x["name"] for x in json.load(f)["traceEvents"])
+    assert {"vault", "start orderly", "orderly rebuild", "web migrate",
+            "proxy certificates"}.issubset(names)
 
 
 def test_notifies_slack_on_fail():
@@ -525,6 +647,57 @@ def test_start_and_stop_multiple_workers():
         orderly_web.stop(path, kill=True, volumes=True, network=True)
 
 
+def test_scale_workers():
+    path = "config/basic"
+    try:
+        orderly_web.start(path)
+        cl = docker.client.from_env()
+
+        def workers():
+            return sorted(x.name for x in cl.containers.list()
+                          if x.name.startswith("orderly-web-orderly-worker-"))
+
+        first = workers()
+        assert len(first) == 1
+
+        orderly_web.scale(path, 3)
+        assert len(workers()) == 3
+        assert set(first).issubset(workers())
+        for name in workers():
+            res = cl.containers.get(name).exec_run(["stat", "/go_signal"])
+            assert res[0] == 0
+        assert fetch_config(path).workers == 3
+        # upgrade keeps the scaled number of workers
+        assert orderly_web.upgrade(path) == []
+        assert len(workers()) == 3
+
+        orderly_web.scale(path, 1)
+        assert workers() == first
+        assert fetch_config(path).workers == 1
+    finally:
+        orderly_web.stop(path, kill=True, volumes=True, network=True)
+
+
+def test_upgrade_web_blue_green():
+    path = "config/basic"
+    options = {"web": {"dev_mode": False}}
+    try:
+        orderly_web.start(path, options=options)
+        cl = docker.client.from_env()
+        old = cl.containers.get("orderly-web-web").id
+
+        res = orderly_web.upgrade(path, options=options, components=["web"],
+                                  blue_green=True)
+        assert res == ["web"]
+        new = cl.containers.get("orderly-web-web")
+        assert new.id != old
+        assert not docker_util.container_exists("orderly-web-web-next")
+        dat = json.loads(http_get("https://localhost/api/v2"))
+        assert dat["status"] == "success"
+    finally:
+        orderly_web.stop(path, kill=True, volumes=True, network=True)
+
+
 def test_wait_for_redis_exists():
     path = "config/basic"
     try:
@@ -579,6 +752,31 @@ def test_orderly_server_not_exposed_to_host():
         orderly_web.stop(path, kill=True, volumes=True, network=True)
 
 
+def test_resolve_secrets_from_vault():
+    with vault_dev.Server() as s:
+        cl = s.client()
+        cl.write("secret/db/password", value="s3cret")
+        cl.write("secret/ssh", public="pub", private="priv")
+        cl.write("secret/github/id", value="ghid")
+        cl.write("secret/github/secret", value="ghsecret")
+        cl.write("secret/slack/webhook", value="https://slack")
+        cl.write("secret/ssl/certificate", value="cert")
+        cl.write("secret/ssl/key", value="key")
+
+        options = {"vault": {"addr": "http://localhost:{}".format(s.port),
+                             "auth": {"method": "token",
+                                      "args": {"token": s.token}}}}
+        cfg = build_config("config/complete", options=options)
+        cfg.resolve_secrets()
+        assert cfg.orderly_env["ORDERLY_DB_PASS"] == "s3cret"
+        assert cfg.orderly_ssh == {"public": "pub", "private": "priv"}
+        assert cfg.web_auth_github_app == {"id": "ghid",
+                                           "secret": "ghsecret"}
+        assert cfg.slack_webhook_url == "https://slack"
+        assert cfg.proxy_ssl_certificate == "cert"
+        assert cfg.proxy_ssl_key == "key"
+
+
 def enable_github_login(cl, path="github"):
     cl.sys.enable_auth_method(method_type="github", path=path)
     policy = """
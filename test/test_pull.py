@@ -0,0 +1,55 @@
+import io
+from contextlib import redirect_stdout
+from unittest import mock
+
+import pytest
+from constellation import ImageReference
+
+from orderly_web.pull import format_bytes, pull
+
+from helpers import module_patch
+
+
+def pull_events(layers):
+    for layer, status in layers:
+        yield {"id": layer, "status": "Downloading",
+               "progressDetail": {"current": 10, "total": 1024}}
+        yield {"id": layer, "status": status, "progressDetail": {}}
+
+
+def test_pull_deduplicates_and_summarises():
+    images = {"orderly": ImageReference("vimc", "orderly.server", "main"),
+              "worker": ImageReference("vimc", "orderly.server", "main"),
+              "redis": ImageReference("library", "redis", "5.0")}
+    cl = mock.MagicMock()
+    cl.api.pull.side_effect = [
+        pull_events([("aaa", "Pull complete"), ("bbb", "Already exists")]),
+        pull_events([("ccc", "Pull complete")])]
+    with module_patch("orderly_web.pull.docker_client") as client:
+        client.return_value.__enter__.return_value = cl
+        f = io.StringIO()
+        with redirect_stdout(f):
+            pull(images)
+    out = f.getvalue()
+    assert cl.api.pull.call_count == 2
+    assert cl.images.get.call_count == 2
+    assert "[orderly] aaa: Pull complete" in out
+    assert "[orderly] bbb: Already exists" in out
+    assert "Downloading" not in out
+    assert "Downloaded 2.0 KB in 2 layers; reused 1 existing layers" in out
+
+
+def test_pull_raises_errors():
+    images = {"redis": ImageReference("library", "redis", "5.0")}
+    cl = mock.MagicMock()
+    cl.api.pull.return_value = iter([{"error": "manifest unknown"}])
+    with module_patch("orderly_web.pull.docker_client") as client:
+        client.return_value.__enter__.return_value = cl
+        with pytest.raises(Exception, match="manifest unknown"):
+            pull(images)
+
+
+def test_format_bytes():
+    assert format_bytes(100) == "100.0 B"
+    assert format_bytes(2048) == "2.0 KB"
+    assert format_bytes(3 * 1024 ** 3) == "3.0 GB"
@@ -0,0 +1,101 @@
+import threading
+import time
+from unittest import mock
+
+import constellation
+import pytest
+
+from orderly_web.config import build_config, config_decode_value, \
+    config_deserialise, config_serialise
+from orderly_web.errors import OrderlyWebConfigError
+from orderly_web.scale import scale, WORKER_STOP_TIMEOUT
+
+from helpers import module_patch
+
+
+def fake_worker(name, created):
+    container = mock.Mock(attrs={"Created": created})
+    container.name = name
+    return container
+
+
+def scale_with(workers, current):
+    cfg = build_config("config/basic")
+    with module_patch("orderly_web.scale.fetch_config", return_value=cfg), \
+            mock.patch.object(constellation.ConstellationService, "get",
+                              return_value=current), \
+            module_patch("orderly_web.scale.start_replicas") as start, \
+            module_patch("orderly_web.scale.config_save") as save:
+        scale("config/basic", workers)
+    save.assert_called_once_with(cfg)
+    assert cfg.workers == workers
+    assert cfg.workers_configured == 1
+    return start
+
+
+def test_scale_up_starts_new_replicas():
+    current = [fake_worker("orderly-web-orderly-worker-a", "1")]
+    start = scale_with(3, current)
+    assert start.call_count == 1
+    assert start.call_args[0][1] == 2
+    current[0].stop.assert_not_called()
+
+
+def test_scale_up_configures_replicas_concurrently():
+    # As after 'start', the configuration is read back from the running
+    # deployment, and its fields decoded as they are first used: here
+    # by each new replica's configure hook, at the same time (made
+    # slower on those threads so that they overlap)
+    saved = build_config("config/basic")
+    cfg = config_deserialise(config_serialise(saved), "config/basic")
+    barrier = threading.Barrier(3, timeout=5)
+    written = []
+
+    def start(self, prefix, network, volumes, data=None):
+        barrier.wait()
+        self.configure(mock.Mock(), data)
+
+    def decode(x):
+        if threading.current_thread() is not threading.main_thread():
+            time.sleep(0.05)
+        return config_decode_value(x)
+
+    current = [fake_worker("orderly-web-orderly-worker-a", "1")]
+    with module_patch("orderly_web.scale.fetch_config", return_value=cfg), \
+            mock.patch.object(constellation.ConstellationService, "get",
+                              return_value=current), \
+            mock.patch.object(constellation.ConstellationContainer, "start",
+                              autospec=True, side_effect=start), \
+            module_patch("orderly_web.config.config_decode_value",
+                         side_effect=decode), \
+            module_patch("orderly_web.constellation.orderly_write_ssh_keys",
+                         side_effect=lambda ssh, x: written.append(ssh)), \
+            module_patch("orderly_web.constellation.worker_start"), \
+            module_patch("orderly_web.scale.config_save"):
+        scale("config/basic", 4)
+    assert written == [saved.orderly_ssh] * 3
+    assert cfg.workers == 4
+
+
+def test_scale_down_removes_newest_replicas():
+    current = [fake_worker("orderly-web-orderly-worker-a", "1"),
+               fake_worker("orderly-web-orderly-worker-b", "3"),
+               fake_worker("orderly-web-orderly-worker-c", "2")]
+    old, new, newer = current[0], current[2], current[1]
+    start = scale_with(1, current)
+    start.assert_not_called()
+    old.stop.assert_not_called()
+    for x in [new, newer]:
+        x.stop.assert_called_once_with(timeout=WORKER_STOP_TIMEOUT)
+        x.remove.assert_called_once_with()
+
+
+def test_scale_requires_running_deployment():
+    with module_patch("orderly_web.scale.fetch_config", return_value=None):
+        with pytest.raises(OrderlyWebConfigError, match="not running"):
+            scale("config/basic", 2)
+
+
+def test_scale_rejects_negative_workers():
+    with pytest.raises(Exception, match="must be non-negative"):
+        scale("config/basic", -1)
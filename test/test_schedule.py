@@ -0,0 +1,113 @@
+import threading
+from unittest import mock
+
+import constellation
+import pytest
+from constellation import ImageReference
+
+from orderly_web.config import build_config
+from orderly_web.constellation import orderly_constellation
+from orderly_web.schedule import dependencies, dependents, run_graph, \
+    start_replicas, stop_containers
+
+
+def test_run_graph_respects_dependencies():
+    order = []
+    lock = threading.Lock()
+
+    def task(name):
+        def f():
+            with lock:
+                order.append(name)
+        return f
+
+    tasks = {x: task(x) for x in ["a", "b", "c", "d"]}
+    deps = {"b": ["a"], "c": ["a"], "d": ["b", "c"]}
+    assert run_graph(tasks, deps) == {"a", "b", "c", "d"}
+    assert order[0] == "a"
+    assert order[-1] == "d"
+    assert set(order[1:3]) == {"b", "c"}
+
+
+def test_run_graph_runs_independent_tasks_together():
+    # Each of these can only complete if the other is running at the
+    # same time; the barrier raises if we are run one at a time.
+    barrier = threading.Barrier(2, timeout=5)
+    tasks = {"a": barrier.wait, "b": barrier.wait}
+    assert run_graph(tasks, {}) == {"a", "b"}
+
+
+def test_run_graph_ignores_dependencies_outside_tasks():
+    tasks = {"b": lambda: None}
+    assert run_graph(tasks, {"b": ["a"]}) == {"b"}
+
+
+def test_run_graph_stops_on_error():
+    ran = []
+
+    def fail():
+        raise Exception("some error")
+
+    tasks = {"a": fail, "b": lambda: ran.append("b")}
+    with pytest.raises(Exception, match="some error"):
+        run_graph(tasks, {"b": ["a"]})
+    assert ran == []
+
+
+def test_run_graph_detects_cycles():
+    tasks = {"a": lambda: None, "b": lambda: None, "c": lambda: None}
+    deps = {"a": ["b"], "b": ["a"]}
+    with pytest.raises(Exception, match="Could not resolve dependencies"):
+        run_graph(tasks, deps)
+
+
+def test_constellation_dependencies():
+    cfg = build_config("config/packit")
+    obj = orderly_constellation(cfg)
+    deps = dependencies(obj.containers.collection)
+    assert deps == {
+        "redis-ow": [],
+        "orderly": ["redis-ow"],
+        "orderly-worker": ["redis-ow", "orderly"],
+        "web": ["orderly"],
+        "outpack-migrate": ["orderly"],
+        "outpack-server": ["outpack-migrate"],
+        "packit-db": [],
+        "packit-api": ["packit-db", "outpack-server"],
+        "packit": ["packit-api"],
+        "proxy": ["web", "packit-api", "packit"]
+    }
+
+
+def test_stop_containers_stops_dependents_first():
+    cfg = build_config("config/packit")
+    obj = orderly_constellation(cfg)
+    assert dependents(obj.containers.collection)["orderly"] == [
+        "orderly-worker", "web", "outpack-migrate"]
+    order = []
+    lock = threading.Lock()
+
+    def stopped(container, *args):
+        with lock:
+            order.append(container.name)
+
+    with mock.patch.object(constellation.ConstellationContainer, "stop",
+                           autospec=True, side_effect=stopped), \
+            mock.patch.object(constellation.ConstellationContainer, "remove",
+                              autospec=True):
+        stop_containers(obj, ["orderly", "web", "proxy"])
+    assert order == ["proxy", "web", "orderly"]
+
+
+def test_start_replicas_runs_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    service = constellation.ConstellationService(
+        "worker", ImageReference("vimc", "orderly.server", "main"), 3)
+    with mock.patch.object(constellation.ConstellationContainer, "start",
+                           autospec=True) as start:
+        start.side_effect = lambda *args: barrier.wait()
+        names = start_replicas(service, 3, "prefix", "network", "volumes")
+    assert len(names) == 3
+    assert len(set(names)) == 3
+    assert all(x.startswith("worker-") for x in names)
+    assert start.call_count == 3
@@ -0,0 +1,155 @@
+import datetime
+import io
+import json
+from contextlib import redirect_stdout
+from unittest import mock
+
+from orderly_web.config import build_config
+from orderly_web.status import event_format, image_digest, parse_time, \
+    status, status_watch
+
+from helpers import module_patch
+
+
+def api_container(name, state="running"):
+    return {"Id": "id-" + name, "Names": ["/" + name], "State": state,
+            "Image": "vimc/" + name, "ImageID": "sha256:" + name}
+
+
+def mock_client(containers):
+    cl = mock.MagicMock()
+    cl.api.containers.return_value = containers
+    cl.api.networks.return_value = [{"Name": "orderly_web_network"}]
+    cl.api.volumes.return_value = {
+        "Volumes": [{"Name": "orderly_web_volume"}]}
+    started = datetime.datetime.now(datetime.timezone.utc) - \
+        datetime.timedelta(minutes=5)
+    cl.api.inspect_container.return_value = {
+        "State": {"Running": True,
+                  "StartedAt": started.strftime(
+                      "%Y-%m-%dT%H:%M:%S.123456789Z")},
+        "RestartCount": 2}
+    cl.api.images.return_value = [
+        {"Id": "sha256:orderly-web-web",
+         "RepoDigests": ["vimc/orderly-web-web@sha256:abc"]},
+        {"Id": "sha256:orderly-web-orderly", "RepoDigests": None}]
+    return cl
+
+
+def run_status(containers, as_json):
+    cfg = build_config("config/basic")
+    cl = mock_client(containers)
+    f = io.StringIO()
+    with module_patch("orderly_web.status.fetch_config", return_value=cfg), \
+            module_patch("orderly_web.status.docker_client") as client, \
+            redirect_stdout(f):
+        client.return_value.__enter__.return_value = cl
+        status("config/basic", as_json)
+    return f.getvalue(), cl
+
+
+CONTAINERS = [api_container("orderly-web-web"),
+              api_container("orderly-web-orderly", "exited"),
+              api_container("orderly-web-orderly-worker-abc"),
+              api_container("orderly-web-orderly-worker-def"),
+              api_container("other-web")]
+
+
+def test_status_text_uses_one_list_call():
+    out, cl = run_status(CONTAINERS, False)
+    assert cl.api.containers.call_count == 1
+    cl.api.inspect_container.assert_not_called()
+    cl.api.images.assert_not_called()
+    assert "Network:\n    - orderly_web_network: created" in out
+    assert "- orderly (orderly_web_volume): created" in out
+    assert "- web (orderly-web-web): running" in out
+    assert "- orderly (orderly-web-orderly): exited" in out
+    assert "- orderly-worker (orderly-web-orderly-worker-<i>): running (2)" \
+        in out
+    assert "- redis-ow (orderly-web-redis-ow): missing" in out
+
+
+def test_status_json():
+    out, cl = run_status(CONTAINERS, True)
+    dat = json.loads(out)
+    assert cl.api.inspect_container.call_count == 4
+    web = dat["components"]["web"]["containers"]
+    assert len(web) == 1
+    assert web[0]["state"] == "running"
+    assert web[0]["image_id"] == "sha256:orderly-web-web"
+    assert web[0]["image_digest"] == "vimc/orderly-web-web@sha256:abc"
+    assert cl.api.images.call_count == 1
+    orderly = dat["components"]["orderly"]["containers"]
+    assert orderly[0]["image_digest"] is None
+    assert web[0]["restart_count"] == 2
+    assert 290 < web[0]["uptime"] < 400
+    workers = dat["components"]["orderly-worker"]["containers"]
+    assert [x["name"] for x in workers] == [
+        "orderly-web-orderly-worker-abc", "orderly-web-orderly-worker-def"]
+    assert dat["components"]["redis"]["containers"] == []
+
+
+def test_image_digest_matches_repo():
+    digests = ["mirror/web@sha256:abc", "vimc/web@sha256:abc"]
+    assert image_digest("vimc/web:master", digests) == "vimc/web@sha256:abc"
+    assert image_digest("vimc/web", digests) == "vimc/web@sha256:abc"
+    assert image_digest("localhost:5000/web:x",
+                        ["localhost:5000/web@sha256:def"]) == \
+        "localhost:5000/web@sha256:def"
+    assert image_digest("localhost:5000/web",
+                        ["localhost:5000/web@sha256:def"]) == \
+        "localhost:5000/web@sha256:def"
+    assert image_digest("sha256:0123", digests) == "mirror/web@sha256:abc"
+    assert image_digest("vimc/web:master", []) is None
+
+
+def test_parse_time():
+    assert parse_time("2024-01-02T03:04:05.123456789Z") == \
+        datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    assert parse_time("0001-01-01T00:00:00Z") is None
+    assert parse_time(None) is None
+
+
+def event(name, action, **attributes):
+    return {"Type": "container", "Action": action, "time": 1700000000,
+            "Actor": {"ID": "abc",
+                      "Attributes": {"name": name, **attributes}}}
+
+
+def test_event_format():
+    cfg = build_config("config/basic")
+    assert event_format(cfg, event("orderly-web-web", "die",
+                                   exitCode="137")) == \
+        "2023-11-14T22:13:20Z web (orderly-web-web): die (exit code 137)"
+    assert event_format(cfg, event("orderly-web-orderly-worker-abc",
+                                   "health_status: unhealthy")) == \
+        "2023-11-14T22:13:20Z orderly-worker " \
+        "(orderly-web-orderly-worker-abc): health_status (unhealthy)"
+    assert json.loads(event_format(cfg, event("orderly-web-orderly", "oom"),
+                                   True)) == {
+        "time": "2023-11-14T22:13:20Z", "component": "orderly",
+        "container": "orderly-web-orderly", "event": "oom", "detail": None,
+        "exit_code": None}
+    assert event_format(cfg, event("other-web", "die")) is None
+    assert event_format(cfg, event("orderly-web-web-next", "die")) is None
+
+
+def test_status_watch_streams_events():
+    cfg = build_config("config/basic")
+    cl = mock.MagicMock()
+    events = mock.MagicMock()
+    events.__iter__.return_value = iter([
+        event("orderly-web-web", "start"),
+        event("other", "start"),
+        event("orderly-web-redis-ow", "die", exitCode="0")])
+    cl.events.return_value = events
+    f = io.StringIO()
+    with module_patch("orderly_web.status.docker_client") as client, \
+            redirect_stdout(f):
+        client.return_value.__enter__.return_value = cl
+        status_watch(cfg, as_json=True)
+    lines = [json.loads(x) for x in f.getvalue().splitlines()]
+    assert [(x["component"], x["event"]) for x in lines] == [
+        ("web", "start"), ("redis", "die")]
+    assert cl.events.call_args[1]["filters"]["type"] == "container"
+    events.close.assert_called_once_with()
@@ -1,32 +1,9 @@
-import importlib
-from unittest.mock import patch
 import pytest
 
 from orderly_web.stop import stop
 from orderly_web.config import build_config
 
-
-# helper from https://stackoverflow.com/questions/52324568/
-# how-to-mock-a-function-called-in-a-function-inside-a-module-
-# with-the-same-name
-def module_patch(*args):
-    target = args[0]
-    components = target.split('.')
-    for i in range(len(components), 0, -1):
-        try:
-            # attempt to import the module
-            imported = importlib.import_module('.'.join(components[:i]))
-
-            # module was imported, let's use it in the patch
-            mock = patch(*args)
-            mock.getter = lambda: imported
-            mock.attribute = '.'.join(components[i:])
-            return mock
-        except Exception as exc:
-            pass
-
-    # did not find a module, just return the default mock
-    return patch(*args)
+from helpers import module_patch
 
 
 def test_stop_fails_if_constellation_errors():
@@ -0,0 +1,157 @@
+import json
+import sqlite3
+from unittest import mock
+
+from orderly_web.sync import STATE_QUERIES, desired_state, read_current, \
+    state_delta, state_from_rows, state_script, sync_permissions
+
+SCHEMA = """
+CREATE TABLE orderlyweb_user (username TEXT, email TEXT PRIMARY KEY);
+CREATE TABLE orderlyweb_user_group (id TEXT PRIMARY KEY);
+CREATE TABLE orderlyweb_user_group_user (email TEXT, user_group TEXT);
+CREATE TABLE orderlyweb_user_group_permission (
+    id INTEGER PRIMARY KEY, user_group TEXT, permission TEXT);
+CREATE TABLE orderlyweb_user_group_global_permission (id INTEGER);
+CREATE TABLE orderlyweb_user_group_report_permission (
+    id INTEGER, report TEXT);
+"""
+
+
+def create_db(path):
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA)
+    for email in ["a@x.com", "b@x.com"]:
+        con.execute("INSERT INTO orderlyweb_user VALUES (?, ?)",
+                    (email, email))
+        con.execute("INSERT INTO orderlyweb_user_group VALUES (?)", (email,))
+        con.execute("INSERT INTO orderlyweb_user_group_user VALUES (?, ?)",
+                    (email, email))
+    con.execute("INSERT INTO orderlyweb_user_group VALUES ('funders')")
+    con.execute("INSERT INTO orderlyweb_user_group_user "
+                "VALUES ('a@x.com', 'funders')")
+    con.execute("INSERT INTO orderlyweb_user_group_permission "
+                "VALUES (1, 'funders', 'reports.read')")
+    con.execute("INSERT INTO orderlyweb_user_group_global_permission "
+                "VALUES (1)")
+    con.execute("INSERT INTO orderlyweb_user_group_permission "
+                "VALUES (2, 'b@x.com', 'reports.run')")
+    con.execute("INSERT INTO orderlyweb_user_group_report_permission "
+                "VALUES (2, 'minimal')")
+    con.commit()
+    con.close()
+
+
+def query_rows(db):
+    # Run the same queries as are run in the orderly container
+    con = sqlite3.connect(db)
+    try:
+        return {k: [list(x) for x in con.execute(v)]
+                for k, v in STATE_QUERIES.items()}
+    finally:
+        con.close()
+
+
+def read_state(db):
+    return state_from_rows(query_rows(db))
+
+
+def test_read_state(tmp_path):
+    db = str(tmp_path / "orderly.sqlite")
+    create_db(db)
+    assert read_state(db) == {
+        "users": {"a@x.com", "b@x.com"},
+        "groups": {
+            "a@x.com": {"members": {"a@x.com"}, "permissions": set()},
+            "b@x.com": {"members": {"b@x.com"},
+                        "permissions": {"report:minimal/reports.run"}},
+            "funders": {"members": {"a@x.com"},
+                        "permissions": {"*/reports.read"}}}}
+
+
+def test_state_delta_is_empty_when_in_sync(tmp_path):
+    db = str(tmp_path / "orderly.sqlite")
+    create_db(db)
+    desired = desired_state({
+        "users": ["a@x.com", "b@x.com"],
+        "groups": {
+            "funders": {"members": ["a@x.com"],
+                        "permissions": ["*/reports.read"]},
+            "b@x.com": {"permissions": ["report:minimal/reports.run"]}}})
+    assert state_delta(read_state(db), desired) == ([], [])
+
+
+def test_state_delta_adds_only_what_is_missing(tmp_path):
+    db = str(tmp_path / "orderly.sqlite")
+    create_db(db)
+    desired = desired_state({
+        "users": ["a@x.com"],
+        "groups": {
+            "funders": {"members": ["a@x.com", "c@x.com"],
+                        "permissions": ["*/reports.read", "*/reports.run"]},
+            "admin": {"members": ["a@x.com"],
+                      "permissions": ["*/reports.review"]}}})
+    operations, extra = state_delta(read_state(db), desired)
+    assert operations == [
+        {"add-users": ["c@x.com"]},
+        {"add-groups": ["admin"]},
+        {"add-members": {"group": "admin", "emails": ["a@x.com"]}},
+        {"grant": {"group": "admin", "permissions": ["*/reports.review"]}},
+        {"add-members": {"group": "funders", "emails": ["c@x.com"]}},
+        {"grant": {"group": "funders", "permissions": ["*/reports.run"]}}]
+    assert extra == ["user b@x.com"]
+
+
+def test_state_delta_adds_users_for_groups_named_by_email():
+    current = {"users": {"a@x.com"},
+               "groups": {"a@x.com": {"members": {"a@x.com"},
+                                      "permissions": set()}}}
+    desired = desired_state({
+        "groups": {"a@x.com": {"permissions": ["*/reports.run"]},
+                   "admin@x.com": {"permissions": ["*/reports.review"]}}})
+    operations, extra = state_delta(current, desired)
+    assert operations == [
+        {"add-users": ["admin@x.com"]},
+        {"grant": {"group": "a@x.com", "permissions": ["*/reports.run"]}},
+        {"grant": {"group": "admin@x.com",
+                   "permissions": ["*/reports.review"]}}]
+    assert extra == []
+
+
+def test_read_current_queries_in_container(tmp_path):
+    db = str(tmp_path / "orderly.sqlite")
+    create_db(db)
+    rows = query_rows(db)
+    cfg = mock.Mock()
+    container = cfg.get_container.return_value
+    container.exec_run.return_value = (0, json.dumps(rows).encode("UTF-8"))
+    assert read_current(cfg) == read_state(db)
+    args = container.exec_run.call_args[0][0]
+    assert args == ["Rscript", "-e", state_script()]
+    for sql in STATE_QUERIES.values():
+        assert json.dumps(sql) in args[2]
+
+
+def test_state_delta_reports_removals():
+    current = {"users": {"a@x.com"},
+               "groups": {"a@x.com": {"members": {"a@x.com"},
+                                      "permissions": {"*/reports.run"}},
+                          "old": {"members": set(), "permissions": set()}}}
+    desired = desired_state({"users": ["a@x.com"],
+                             "groups": {"a@x.com": None}})
+    assert state_delta(current, desired) == (
+        [], ["group old", "permission */reports.run of a@x.com"])
+
+
+def test_sync_dry_run_does_not_apply(tmp_path):
+    db = str(tmp_path / "orderly.sqlite")
+    create_db(db)
+    filename = tmp_path / "permissions.yml"
+    filename.write_text("users: [a@x.com, b@x.com, c@x.com]\n")
+    cfg = mock.Mock()
+    with mock.patch("orderly_web.sync.fetch_config", return_value=cfg), \
+            mock.patch("orderly_web.sync.read_current",
+                       return_value=read_state(db)), \
+            mock.patch("orderly_web.sync.apply_operations") as apply:
+        res = sync_permissions("path", str(filename), dry_run=True)
+    assert res == [{"add-users": ["c@x.com"]}]
+    apply.assert_not_called()
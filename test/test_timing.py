@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from unittest import mock
+
+from orderly_web.timing import span, timing_format, timing_message, \
+    timing_reset, timing_slowest, timing_spans, timing_summary, \
+    timing_total, trace_write
+
+from helpers import module_patch
+
+
+def fake_span(name, start, duration, leaf=True, thread=1):
+    return {"name": name, "start": start, "duration": duration,
+            "leaf": leaf, "thread": thread}
+
+
+SPANS = [fake_span("vault", 0.0, 0.5),
+         fake_span("start orderly", 0.5, 30.0, leaf=False),
+         fake_span("orderly rebuild", 1.0, 20.0),
+         fake_span("start orderly-worker", 31.0, 2.0, thread=2),
+         fake_span("start orderly-worker", 31.0, 3.0, thread=3),
+         fake_span("web migrate", 32.0, 10.0, thread=2)]
+
+
+def test_span_records_nesting_and_threads():
+    timing_reset()
+    with span("outer"):
+        with span("inner"):
+            time.sleep(0.01)
+
+    def other():
+        with span("thread"):
+            pass
+    with span("waiting"):
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+    spans = timing_spans()
+    assert [x["name"] for x in spans] == ["outer", "inner", "waiting",
+                                          "thread"]
+    outer, inner, waiting, thread = spans
+    # Spans on other threads are not nested within this thread's spans
+    assert not outer["leaf"]
+    assert inner["leaf"] and waiting["leaf"] and thread["leaf"]
+    assert thread["thread"] != waiting["thread"]
+    assert outer["duration"] >= inner["duration"] >= 0.01
+    assert 0 <= outer["start"] <= inner["start"] < 1
+
+    timing_reset()
+    assert timing_spans() == []
+
+
+def test_span_is_recorded_on_error():
+    timing_reset()
+    try:
+        with span("fails"):
+            raise Exception("some error")
+    except Exception:
+        pass
+    assert [x["name"] for x in timing_spans()] == ["fails"]
+
+
+def test_timing_summary():
+    summary = timing_summary(SPANS)
+    assert list(summary) == ["vault", "start orderly", "orderly rebuild",
+                             "start orderly-worker", "web migrate"]
+    assert summary["start orderly-worker"] == {"count": 2, "total": 5.0}
+    assert "start orderly" not in timing_summary(SPANS, leaf_only=True)
+    assert timing_total(SPANS) == 42.0
+    assert timing_total([]) == 0
+
+
+def test_timing_slowest_ignores_parent_spans():
+    assert timing_slowest(SPANS) == [("orderly rebuild", 20.0),
+                                     ("web migrate", 10.0),
+                                     ("start orderly-worker", 5.0)]
+    assert timing_message(SPANS) == (
+        "in 42.0s (slowest: orderly rebuild 20.0s, web migrate 10.0s, "
+        "start orderly-worker 5.0s)")
+    assert timing_message([]) == "in 0.0s"
+
+
+def test_timing_format():
+    lines = timing_format(SPANS).splitlines()
+    assert lines[0] == "Timings:"
+    assert lines[4] == "  start orderly-worker             5.0s (x2)"
+    assert lines[-1] == "  total                           42.0s"
+
+
+def test_trace_write(tmp_path):
+    filename = str(tmp_path / "trace.json")
+    trace_write(SPANS, filename)
+    with open(filename) as f:
+        dat = json.load(f)
+    events = dat["traceEvents"]
+    assert len(events) == len(SPANS)
+    assert events[2] == {"name": "orderly rebuild", "ph": "X", "pid": 1,
+                         "tid": 1, "ts": 1000000, "dur": 20000000}
+    assert [x["tid"] for x in events] == [1, 1, 1, 2, 3, 2]
+
+
+def test_start_reports_timings(tmp_path):
+    from orderly_web.start import start
+    trace = str(tmp_path / "trace.json")
+
+    def start_constellation(obj):
+        with span("start orderly"):
+            with span("orderly rebuild"):
+                time.sleep(0.05)
+
+    cfg = mock.MagicMock(web_url="https://example.com")
+    with module_patch("orderly_web.start.build_config", return_value=cfg), \
+            module_patch("orderly_web.start.orderly_constellation"), \
+            module_patch("orderly_web.start.start_constellation",
+                         side_effect=start_constellation), \
+            module_patch("orderly_web.start.Notifier") as notifier:
+        assert start("path", trace=trace)
+    post = notifier.return_value.post
+    assert post.call_count == 2
+    msg = post.call_args_list[1][0][0]
+    assert msg.startswith("*Completed* deploy to https://example.com "
+                          ":shipit: in ")
+    assert "slowest: orderly rebuild" in msg
+    with open(trace) as f:
+        names = [x["name"] for x in json.load(f)["traceEvents"]]
+    assert names == ["vault", "start orderly", "orderly rebuild"]
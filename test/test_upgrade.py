@@ -0,0 +1,202 @@
+import shutil
+from unittest import mock
+
+import docker
+import pytest
+
+from orderly_web.config import build_config, config_deserialise, \
+    config_serialise
+from orderly_web.constellation import orderly_constellation
+from orderly_web.errors import OrderlyWebConfigError
+from orderly_web.upgrade import component_names, image_changes, upgrade, \
+    upgrade_changes, upgrade_plan
+
+from helpers import module_patch
+
+
+def changes(path, options):
+    old = build_config(path)
+    old = config_deserialise(config_serialise(old), old.path)
+    cfg = build_config(path, options=options)
+    old_obj = orderly_constellation(old)
+    obj = orderly_constellation(cfg)
+    return upgrade_changes(old, old_obj, cfg, obj), old_obj, obj
+
+
+def test_saved_config_has_no_changes():
+    changed, _, _ = changes("config/packit", [])
+    assert changed == set()
+
+
+def test_image_change_recreates_container_and_dependents():
+    changed, old_obj, obj = changes(
+        "config/packit", [{"web": {"image": {"tag": "mrc-1234"}}}])
+    assert changed == {"web"}
+    assert upgrade_plan(changed, set(), old_obj, obj) == {"web", "proxy"}
+
+
+def test_configure_change_recreates_container():
+    changed, old_obj, obj = changes(
+        "config/packit", [{"web": {"url": "https://example.com"}}])
+    assert changed == {"web"}
+
+
+def test_worker_scale_change_only_recreates_workers():
+    changed, old_obj, obj = changes(
+        "config/packit", [{"orderly": {"workers": 3}}])
+    assert changed == {"orderly-worker"}
+    assert upgrade_plan(changed, set(), old_obj, obj) == {"orderly-worker"}
+
+
+def test_redis_change_recreates_dependents():
+    changed, old_obj, obj = changes(
+        "config/packit", [{"redis": {"image": {"tag": "6.0"}}}])
+    assert changed == {"redis-ow"}
+    assert upgrade_plan(changed, set(), old_obj, obj) == {
+        "redis-ow", "orderly", "orderly-worker", "web", "outpack-migrate",
+        "outpack-server", "packit-api", "packit", "proxy"}
+
+
+def test_edited_web_file_recreates_web(tmp_path):
+    path = str(tmp_path / "config")
+    shutil.copytree("config/customcss", path)
+    old = build_config(path)
+    old.record_files()
+    old = config_deserialise(config_serialise(old), path)
+    cfg = build_config(path)
+    cfg.record_files()
+    old_obj = orderly_constellation(old)
+    obj = orderly_constellation(cfg)
+    assert upgrade_changes(old, old_obj, cfg, obj) == set()
+
+    with open(cfg.sass_variables, "a") as f:
+        f.write("$navbar-color: red;\n")
+    cfg = build_config(path)
+    cfg.record_files()
+    obj = orderly_constellation(cfg)
+    assert upgrade_changes(old, old_obj, cfg, obj) == {"web"}
+
+
+def test_forced_component_is_recreated():
+    cfg = build_config("config/packit")
+    obj = orderly_constellation(cfg)
+    forced = component_names(["web"], cfg, obj)
+    assert upgrade_plan(set(), forced, obj, obj) == {"web", "proxy"}
+    forced = component_names(["redis"], cfg, obj)
+    assert forced == {"redis-ow"}
+    with pytest.raises(OrderlyWebConfigError, match="Unknown component"):
+        component_names(["other"], cfg, obj)
+
+
+def test_forced_component_must_cover_changes():
+    changed, old_obj, obj = changes(
+        "config/packit", [{"redis": {"image": {"tag": "6.0"}}}])
+    with pytest.raises(OrderlyWebConfigError,
+                       match="Configuration for redis-ow has also changed"):
+        upgrade_plan(changed, {"web"}, old_obj, obj)
+
+
+def test_upgrade_recreates_changed_containers():
+    old = build_config("config/packit")
+    options = [{"web": {"image": {"tag": "mrc-1234"}}}]
+    with module_patch("orderly_web.upgrade.fetch_config",
+                      return_value=old), \
+            module_patch("orderly_web.upgrade.image_changes",
+                         return_value=set()), \
+            module_patch("orderly_web.upgrade.stop_containers") as stop, \
+            module_patch("orderly_web.upgrade.start_constellation") as start, \
+            module_patch("orderly_web.upgrade.config_save") as save:
+        assert upgrade("config/packit", options=options) == ["proxy", "web"]
+    assert stop.call_args[0][1] == ["proxy", "web"]
+    assert start.call_args[1] == {"subset": ["proxy", "web"]}
+    assert save.call_args[0][0].web_tag == "mrc-1234"
+
+
+def test_upgrade_keeps_scaled_workers():
+    old = build_config("config/packit")
+    old.workers = 3
+    old = config_deserialise(config_serialise(old), old.path)
+    with module_patch("orderly_web.upgrade.fetch_config",
+                      return_value=old), \
+            module_patch("orderly_web.upgrade.image_changes",
+                         return_value=set()), \
+            module_patch("orderly_web.upgrade.stop_containers") as stop:
+        assert upgrade("config/packit") == []
+    stop.assert_not_called()
+
+
+def test_upgrade_uses_changed_configured_workers():
+    old = build_config("config/packit")
+    old.workers = 3
+    options = [{"orderly": {"workers": 2}}]
+    with module_patch("orderly_web.upgrade.fetch_config",
+                      return_value=old), \
+            module_patch("orderly_web.upgrade.image_changes",
+                         return_value=set()), \
+            module_patch("orderly_web.upgrade.stop_containers"), \
+            module_patch("orderly_web.upgrade.start_constellation"), \
+            module_patch("orderly_web.upgrade.config_save") as save:
+        assert upgrade("config/packit", options=options) == \
+            ["orderly-worker"]
+    cfg = save.call_args[0][0]
+    assert cfg.workers == 2
+    assert cfg.workers_configured == 2
+
+
+def test_upgrade_does_nothing_if_unchanged():
+    old = build_config("config/packit")
+    with module_patch("orderly_web.upgrade.fetch_config",
+                      return_value=old), \
+            module_patch("orderly_web.upgrade.image_changes",
+                         return_value=set()), \
+            module_patch("orderly_web.upgrade.stop_containers") as stop:
+        assert upgrade("config/packit") == []
+    stop.assert_not_called()
+
+
+def test_image_changes_compares_running_image_ids():
+    cfg = build_config("config/basic")
+    obj = orderly_constellation(cfg)
+
+    def container(name, image_id):
+        return {"Names": ["/orderly-web-" + name], "ImageID": image_id}
+
+    def inspect_image(ref):
+        if ref.startswith("vimc/orderly-web-proxy"):
+            raise docker.errors.ImageNotFound("not pulled")
+        return {"Id": "sha256:new"}
+
+    cl = mock.MagicMock()
+    cl.api.containers.return_value = [
+        container("redis-ow", "sha256:new"),
+        container("orderly", "sha256:new"),
+        container("orderly-worker-abc", "sha256:new"),
+        container("orderly-worker-def", "sha256:old"),
+        container("web", "sha256:old"),
+        container("proxy", "sha256:old")]
+    cl.api.inspect_image.side_effect = inspect_image
+    with module_patch("orderly_web.upgrade.docker_client") as client:
+        client.return_value.__enter__.return_value = cl
+        assert image_changes(obj) == {"orderly-worker", "web"}
+    # Each image is looked up once, though orderly and the workers share
+    # theirs
+    refs = [x[0][0] for x in cl.api.inspect_image.call_args_list]
+    assert len(refs) == len(set(refs))
+
+
+def test_upgrade_pulls_before_comparing_images():
+    old = build_config("config/packit")
+    order = []
+    with module_patch("orderly_web.upgrade.fetch_config",
+                      return_value=old), \
+            module_patch("orderly_web.upgrade.pull",
+                         side_effect=lambda x: order.append("pull")), \
+            module_patch("orderly_web.upgrade.image_changes",
+                         side_effect=lambda x: order.append("compare") or
+                         {"web"}), \
+            module_patch("orderly_web.upgrade.stop_containers") as stop, \
+            module_patch("orderly_web.upgrade.start_constellation"), \
+            module_patch("orderly_web.upgrade.config_save"):
+        assert upgrade("config/packit", pull_images=True) == ["proxy", "web"]
+    assert order == ["pull", "compare"]
+    assert stop.call_args[0][1] == ["proxy", "web"]
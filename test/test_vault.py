@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from orderly_web.config import build_config
+from orderly_web.vault import vault_read, vault_references, vault_resolve
+
+
+class FakeVaultClient:
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.reads = []
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        with self.lock:
+            self.reads.append(path)
+        if path not in self.secrets:
+            return None
+        return {"data": self.secrets[path]}
+
+
+class FakeVaultConfig:
+    def __init__(self, client):
+        self._client = client
+        self.logins = 0
+
+    def client(self):
+        self.logins += 1
+        return self._client
+
+
+def test_vault_references_finds_nested_values():
+    x = {"a": "VAULT:secret/a:value",
+         "b": {"c": "VAULT:secret/b:c", "d": "plain"},
+         "e": 1}
+    found = vault_references(x)
+    assert [r[1:] for r in found] == [
+        ("a", "secret/a", "value"),
+        ("c", "secret/b", "c")]
+    assert found[1][0] is x["b"]
+
+
+def test_vault_references_rejects_invalid_accessor():
+    with pytest.raises(Exception, match="Invalid vault accessor"):
+        vault_references({"a": "VAULT:secret/a"})
+
+
+def test_vault_read_fetches_paths_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    class BlockingClient(FakeVaultClient):
+        def read(self, path):
+            barrier.wait()
+            return super().read(path)
+
+    cl = BlockingClient({"secret/a": {"value": "1"},
+                         "secret/b": {"value": "2"}})
+    res = vault_read(cl, ["secret/a", "secret/b", "secret/a"])
+    assert res == {"secret/a": {"data": {"value": "1"}},
+                   "secret/b": {"data": {"value": "2"}}}
+    assert sorted(cl.reads) == ["secret/a", "secret/b"]
+
+
+def test_vault_resolve_reads_each_path_once():
+    cfg = build_config("config/complete")
+    cl = FakeVaultClient({
+        "secret/db/password": {"value": "dbpass"},
+        "secret/ssh": {"public": "pub", "private": "priv"},
+        "secret/github/id": {"value": "ghid"},
+        "secret/github/secret": {"value": "ghsecret"},
+        "secret/slack/webhook": {"value": "https://slack"},
+        "secret/ssl/certificate": {"value": "cert"},
+        "secret/ssl/key": {"value": "key"}})
+    vault_config = FakeVaultConfig(cl)
+    vault_resolve(cfg, vault_config)
+    assert vault_config.logins == 1
+    assert sorted(cl.reads) == sorted(cl.secrets.keys())
+    assert cfg.orderly_env["ORDERLY_DB_PASS"] == "dbpass"
+    assert cfg.orderly_ssh == {"public": "pub", "private": "priv"}
+    assert cfg.web_auth_github_app == {"id": "ghid", "secret": "ghsecret"}
+    assert cfg.slack_webhook_url == "https://slack"
+    assert cfg.proxy_ssl_certificate == "cert"
+    assert cfg.proxy_ssl_key == "key"
+
+
+def test_vault_resolve_does_not_login_without_references():
+    cfg = build_config("config/basic")
+    vault_config = FakeVaultConfig(FakeVaultClient({}))
+    vault_resolve(cfg, vault_config)
+    assert vault_config.logins == 0
+
+
+def test_vault_resolve_reports_missing_secrets():
+    cl = FakeVaultClient({"secret/a": {"value": "1"}})
+    with pytest.raises(Exception, match="Did not find secret at 'secret/b'"):
+        vault_resolve({"x": "VAULT:secret/b:value"}, FakeVaultConfig(cl))
+    with pytest.raises(Exception,
+                       match="Did not find key 'other' at secret path"):
+        vault_resolve({"x": "VAULT:secret/a:other"}, FakeVaultConfig(cl))